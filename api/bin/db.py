@@ -5,3 +5,4 @@ import mysql
 mysql.create_database()
 data = mysql.MySQL()
 mysql.Base.metadata.create_all(data.engine)
+mysql.migrate(data.engine)
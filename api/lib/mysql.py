@@ -4,7 +4,9 @@ import time
 import yaml
 import pymysql
 import sqlalchemy
+import sqlalchemy.exc
 import sqlalchemy.orm
+import sqlalchemy.event
 import sqlalchemy.ext.declarative
 import sqlalchemy.ext.mutable
 import flask_jsontools
@@ -72,9 +74,35 @@ Base = sqlalchemy.ext.declarative.declarative_base(cls=(flask_jsontools.JsonSeri
 def now():
     return time.time()
 
+def deadline(data, expire=True):
+    """
+    Determines when there'll next be a need to expire or remind
+    """
+
+    deadlines = []
+
+    # Until it's started and notified, there's nothing to count from
+
+    if expire and "expires" in data and "start" in data:
+        deadlines.append(data["start"] + data["expires"])
+
+    if "interval" in data and "notified" in data and not data.get("paused"):
+
+        remind = data["notified"] + data["interval"]
+
+        if "delay" in data and "start" in data:
+            remind = max(remind, data["start"] + data["delay"])
+
+        deadlines.append(remind)
+
+    return min(deadlines) if deadlines else None
+
 class Person(Base):
 
     __tablename__ = "person"
+    __table_args__ = (
+        sqlalchemy.schema.UniqueConstraint('name', name='person_label'),
+    )
     
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     name = sqlalchemy.Column(sqlalchemy.String(64), nullable=False)
@@ -86,8 +114,6 @@ class Person(Base):
         default=dict
     )
 
-    sqlalchemy.schema.UniqueConstraint('name', name='label')
-
     def __repr__(self):
         return "<Person(name='%s')>" % (self.name)
 
@@ -95,6 +121,9 @@ class Person(Base):
 class Template(Base):
 
     __tablename__ = "template"
+    __table_args__ = (
+        sqlalchemy.schema.UniqueConstraint('kind', 'name', name='template_label'),
+    )
     
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     name = sqlalchemy.Column(sqlalchemy.String(128), nullable=False)
@@ -107,8 +136,6 @@ class Template(Base):
         default=dict
     )
 
-    sqlalchemy.schema.UniqueConstraint('name', 'kind', name='label')
-
     def __repr__(self):
         return "<Template(name='%s',kind='%s')>" % (self.name, self.kind)
 
@@ -116,6 +143,11 @@ class Template(Base):
 class Area(Base):
 
     __tablename__ = "area"
+    __table_args__ = (
+        sqlalchemy.schema.UniqueConstraint('name', name='area_label'),
+        sqlalchemy.Index('area_person_status', 'person_id', 'status'),
+        sqlalchemy.Index('area_updated', 'updated')
+    )
     
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     person_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("person.id"), nullable=False)
@@ -131,9 +163,7 @@ class Area(Base):
         default=dict
     )
 
-    sqlalchemy.schema.UniqueConstraint('name', name='label')
-
-    person = sqlalchemy.orm.relationship("Person") 
+    person = sqlalchemy.orm.relationship("Person")
 
     def __repr__(self):
         return "<Area(name='%s')>" % (self.name)
@@ -142,6 +172,12 @@ class Area(Base):
 class Act(Base):
 
     __tablename__ = "act"
+    __table_args__ = (
+        sqlalchemy.schema.UniqueConstraint('name', 'person_id', 'created', name='act_label'),
+        sqlalchemy.Index('act_person_status_created', 'person_id', 'status', 'created'),
+        sqlalchemy.Index('act_status_created', 'status', 'created'),
+        sqlalchemy.Index('act_updated', 'updated')
+    )
     
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     person_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("person.id"), nullable=False)
@@ -157,9 +193,7 @@ class Act(Base):
         default=dict
     )
 
-    person = sqlalchemy.orm.relationship("Person") 
-
-    sqlalchemy.schema.UniqueConstraint('name', 'person_id', 'created', name='label')
+    person = sqlalchemy.orm.relationship("Person")
 
     def __repr__(self):
         return "<Act(name='%s',person='%s',created=%s)>" % (self.name, self.person.name, self.created)
@@ -168,6 +202,12 @@ class Act(Base):
 class ToDo(Base):
 
     __tablename__ = "todo"
+    __table_args__ = (
+        sqlalchemy.schema.UniqueConstraint('name', 'person_id', 'created', name='todo_label'),
+        sqlalchemy.Index('todo_person_status_created', 'person_id', 'status', 'created'),
+        sqlalchemy.Index('todo_status_created', 'status', 'created'),
+        sqlalchemy.Index('todo_updated', 'updated')
+    )
     
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     person_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("person.id"), nullable=False)
@@ -183,9 +223,7 @@ class ToDo(Base):
         default=dict
     )
 
-    person = sqlalchemy.orm.relationship("Person") 
-
-    sqlalchemy.schema.UniqueConstraint('name', 'person_id', 'created', name='label')
+    person = sqlalchemy.orm.relationship("Person")
 
     def __repr__(self):
         return "<ToDo(name='%s',person='%s',created=%s)>" % (self.name, self.person.name, self.created)
@@ -194,6 +232,13 @@ class ToDo(Base):
 class Routine(Base):
 
     __tablename__ = "routine"
+    __table_args__ = (
+        sqlalchemy.schema.UniqueConstraint('name', 'person_id', 'created', name='routine_label'),
+        sqlalchemy.Index('routine_person_status_created', 'person_id', 'status', 'created'),
+        sqlalchemy.Index('routine_status_created', 'status', 'created'),
+        sqlalchemy.Index('routine_updated', 'updated'),
+        sqlalchemy.Index('routine_status_due', 'status', 'due')
+    )
     
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     person_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("person.id"), nullable=False)
@@ -209,9 +254,98 @@ class Routine(Base):
         default=dict
     )
 
-    person = sqlalchemy.orm.relationship("Person") 
+    due = sqlalchemy.Column(sqlalchemy.Float(53))
 
-    sqlalchemy.schema.UniqueConstraint('name', 'person_id', 'created', name='label')
+    person = sqlalchemy.orm.relationship("Person")
 
     def __repr__(self):
         return "<Routine(name='%s',person='%s',created=%s)>" % (self.name, self.person.name, self.created)
+
+    def deadline(self):
+        """
+        Determines when the routine or its current task next needs attention
+        """
+
+        if self.status == "closed" or not self.data:
+            return None
+
+        deadlines = [deadline(self.data)]
+
+        for task in self.data.get("tasks", []):
+
+            if "start" in task and "end" not in task:
+                deadlines.append(deadline(task, expire=False))
+                break
+
+        deadlines = [when for when in deadlines if when is not None]
+
+        return min(deadlines) if deadlines else None
+
+@sqlalchemy.event.listens_for(Routine, "before_insert")
+@sqlalchemy.event.listens_for(Routine, "before_update")
+def routine_due(mapper, connection, routine):
+    """
+    Keeps due current whenever a routine is written so due ones can be found in SQL
+    """
+
+    routine.due = routine.deadline()
+
+
+def migrate(engine):
+    """
+    Adds any columns, indexes and unique constraints missing from existing tables
+    """
+
+    inspector = sqlalchemy.inspect(engine)
+
+    for table in Base.metadata.sorted_tables:
+
+        if table.name not in inspector.get_table_names():
+            continue
+
+        existing = [column["name"] for column in inspector.get_columns(table.name)]
+
+        for column in table.columns:
+
+            if column.name in existing:
+                continue
+
+            engine.execute(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}")
+
+            # Touch every routine so the event fills in due
+
+            if table.name == "routine" and column.name == "due":
+
+                session = sqlalchemy.orm.Session(bind=engine)
+
+                for routine in session.query(Routine).filter_by(status="opened").all():
+                    sqlalchemy.orm.attributes.flag_modified(routine, "data")
+
+                session.commit()
+                session.close()
+
+        # Unique constraints are unique indexes as far as MySQL's concerned, and
+        # adding them as such works wherever else the tests run
+
+        existing = [index["name"] for index in inspector.get_indexes(table.name)]
+        existing.extend(constraint["name"] for constraint in inspector.get_unique_constraints(table.name))
+
+        creates = [
+            (index.name, sqlalchemy.schema.CreateIndex(index))
+            for index in table.indexes
+        ]
+        creates.extend(
+            (constraint.name, f"CREATE UNIQUE INDEX {constraint.name} ON {table.name} ({', '.join(constraint.columns.keys())})")
+            for constraint in table.constraints
+            if isinstance(constraint, sqlalchemy.schema.UniqueConstraint)
+        )
+
+        for (name, create) in creates:
+
+            if name in existing:
+                continue
+
+            try:
+                engine.execute(create)
+            except sqlalchemy.exc.IntegrityError as exception:
+                print(f"can't add {name} to {table.name} until duplicates are removed: {exception}")
@@ -2,21 +2,95 @@ import os
 import time
 import copy
 import json
+import base64
 import yaml
+import hashlib
 import requests
 import functools
+import threading
 import traceback
+import collections
 
 import redis
 import flask
 import flask_restful
+import sqlalchemy
 import sqlalchemy.exc
+import sqlalchemy.orm
+import sqlalchemy.event
+import werkzeug.http
+import werkzeug.exceptions
 
 import opengui
 import pykube
 
 import mysql
 
+RENDERINGS = 1024
+PARSINGS = 256
+CACHE_TTL = 0
+CHOICES = 256
+CHOICES_TTL = 60
+
+# Use libyaml if it's there
+
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+class Cache(object):
+    """
+    Keeps the most recently used so many values, safe across threads
+    """
+
+    def __init__(self, size):
+
+        self.size = size
+        self.values = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+
+        with self.lock:
+
+            if key not in self.values:
+                return None
+
+            self.values.move_to_end(key)
+
+            return self.values[key]
+
+    def set(self, key, value):
+
+        with self.lock:
+
+            self.values[key] = value
+
+            while len(self.values) > self.size:
+                self.values.popitem(last=False)
+
+class Schema(object):
+    """
+    Field definitions compiled once, handing out copies cheap enough to build
+    Fields from on every request, with whatever changes per request overlaid
+    """
+
+    def __init__(self, fields):
+
+        self.fields = tuple(copy.deepcopy(field) for field in fields)
+
+    def overlay(self, **overlays):
+
+        return [dict(field, **overlays.get(field["name"], {})) for field in self.fields]
+
+schemas = {}
+
+renderings = Cache(RENDERINGS)
+parsings = Cache(PARSINGS)
+choosings = Cache(CHOICES)
+
+versions = collections.Counter()
+versioning = threading.Lock()
+
 def app():
 
     app = flask.Flask("nandy-io-speech-api")
@@ -25,6 +99,7 @@ def app():
 
     app.redis = redis.StrictRedis(host=os.environ['REDIS_HOST'], port=int(os.environ['REDIS_PORT']))
     app.channel = os.environ['REDIS_CHANNEL']
+    app.cache = int(os.environ.get("CACHE_TTL", CACHE_TTL))
 
     if os.path.exists("/var/run/secrets/kubernetes.io/serviceaccount/token"):
         app.kube = pykube.HTTPClient(pykube.KubeConfig.from_service_account())
@@ -48,13 +123,23 @@ def app():
     api.add_resource(ToDoRUD, '/todo/<int:id>')
     api.add_resource(ToDoA, '/todo/<int:id>/<action>')
     api.add_resource(RoutineCL, '/routine')
+    api.add_resource(RoutineDue, '/routine/due')
     api.add_resource(RoutineRUD, '/routine/<int:id>')
     api.add_resource(RoutineA, '/routine/<int:id>/<action>')
     api.add_resource(TaskA, '/routine/<int:routine_id>/task/<int:task_id>/<action>')
+    api.add_resource(Batch, '/batch')
 
     return app
 
 
+def conflict(exception):
+    """
+    Says what's already there, like something of the same name made for the
+    same person in the same second
+    """
+
+    return f"already exists: {exception.orig}"
+
 def require_session(endpoint):
     @functools.wraps(endpoint)
     def wrap(*args, **kwargs):
@@ -65,6 +150,20 @@ def require_session(endpoint):
 
             response = endpoint(*args, **kwargs)
 
+        except werkzeug.exceptions.BadRequest as exception:
+
+            response = flask.make_response(json.dumps({"message": exception.description}))
+            response.headers.set('Content-Type', 'application/json')
+            response.status_code = 400
+
+        except sqlalchemy.exc.IntegrityError as exception:
+
+            response = flask.make_response(json.dumps({"message": conflict(exception)}))
+            response.headers.set('Content-Type', 'application/json')
+            response.status_code = 409
+
+            flask.request.session.rollback()
+
         except sqlalchemy.exc.InvalidRequestError:
 
             response = flask.make_response(json.dumps({
@@ -82,6 +181,8 @@ def require_session(endpoint):
             response.headers.set('Content-Type', 'application/json')
             response.status_code = 500
 
+        invalidate(flask.request.session.info.get("changed"))
+
         flask.request.session.close()
 
         return response
@@ -89,6 +190,141 @@ def require_session(endpoint):
     return wrap
 
 
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_flush")
+def flushed(session, context):
+    """
+    Remembers what kinds of things were changed so what's cached or memoized of them can be dropped
+    """
+
+    kinds = {instance.__tablename__ for instance in list(session.new) + list(session.dirty) + list(session.deleted)}
+
+    session.info.setdefault("changed", set()).update(kinds)
+    session.info.setdefault("uncommitted", set()).update(kinds)
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_bulk_update")
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_bulk_delete")
+def bulked(context):
+
+    context.session.info.setdefault("changed", set()).add(context.mapper.local_table.name)
+    context.session.info.setdefault("uncommitted", set()).add(context.mapper.local_table.name)
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_commit")
+def committed(session):
+    """
+    Moves the versions of what was changed along, once others can see the changes
+    """
+
+    with versioning:
+        for kind in session.info.pop("uncommitted", []):
+            versions[kind] += 1
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_rollback")
+def rolledback(session):
+
+    session.info.pop("uncommitted", None)
+
+def memoize(kinds, key, load):
+    """
+    What load returns, remembered until any of those kinds change here, or until a
+    little while passes, for changes made by other replicas
+    """
+
+    key = (tuple((kind, versions[kind]) for kind in kinds), key)
+    memo = choosings.get(key)
+
+    if memo is None or memo[0] < time.time():
+        memo = (time.time() + CHOICES_TTL, load())
+        choosings.set(key, memo)
+
+    return copy.deepcopy(memo[1])
+
+def invalidate(kinds):
+    """
+    Moves the generation of the kinds changed along, so what's cached of them is
+    never read again, and of everything if people were, as they're expanded into
+    everything else
+    """
+
+    if not kinds or not flask.current_app.cache:
+        return
+
+    if "person" in kinds:
+        kinds = mysql.Base.metadata.tables.keys()
+
+    try:
+        for kind in sorted(kinds):
+            flask.current_app.redis.incr(f"{flask.current_app.channel}/cache/{kind}")
+    except redis.exceptions.RedisError:
+        pass
+
+def cached(endpoint):
+    """
+    Serves GETs from what's cached in Redis, shared across replicas, caching what
+    isn't yet for however long's configured. Anything relative to now isn't cached.
+    """
+
+    @functools.wraps(endpoint)
+    def wrap(self, *args, **kwargs):
+
+        if not flask.current_app.cache or "since" in flask.request.args:
+            return endpoint(self, *args, **kwargs)
+
+        # The generation's read before querying, so a response that raced a change
+        # is cached under the generation the change already moved past
+
+        prefix = f"{flask.current_app.channel}/cache/{self.SINGULAR}"
+
+        try:
+            generation = int(flask.current_app.redis.get(prefix) or 0)
+            key = f"{prefix}/{generation}/{etag(flask.request.path, flask.request.args.to_dict())}"
+            hit = flask.current_app.redis.get(key)
+        except redis.exceptions.RedisError:
+            return endpoint(self, *args, **kwargs)
+
+        if hit is not None:
+
+            (response, tag) = json.loads(hit)
+
+            if unchanged(tag):
+                return not_modified(tag)
+
+            return response, 200, {"ETag": werkzeug.http.quote_etag(tag)}
+
+        response = endpoint(self, *args, **kwargs)
+
+        if isinstance(response, tuple) and response[1] == 200:
+
+            try:
+                flask.current_app.redis.set(
+                    key,
+                    json.dumps([response[0], werkzeug.http.unquote_etag(response[2]["ETag"])[0]]),
+                    ex=flask.current_app.cache
+                )
+            except redis.exceptions.RedisError:
+                pass
+
+        return response
+
+    return wrap
+
+
+def parse(text):
+    """
+    Loads yaml, reusing what the same text last loaded as, so what was validated
+    isn't parsed all over again when it's saved
+    """
+
+    key = hashlib.sha1(text.encode()).hexdigest()
+    parsed = parsings.get(key)
+
+    if parsed is None:
+        parsed = yaml.load(text, Loader=Loader)
+        parsings.set(key, parsed)
+
+    # Callers change what they get, so never hand out what's cached
+
+    return copy.deepcopy(parsed)
+
 def validate(fields):
 
     valid = fields.validate()
@@ -98,7 +334,7 @@ def validate(fields):
         if field.name != "yaml" or field.value is None:
             continue
 
-        if not isinstance(yaml.safe_load(field.value), dict):
+        if not isinstance(parse(field.value), dict):
             field.errors.append("must be dict")
             valid = False
 
@@ -111,29 +347,133 @@ def model_in(converted):
     for field in converted.keys():
 
         if field == "yaml":
-            fields["data"] = yaml.safe_load(converted[field])
+            fields["data"] = parse(converted[field])
         else:
             fields[field] = converted[field]
 
     return fields
 
-def model_out(model):
+def projection(model, args):
+    """
+    The fields asked for, if any, always with id, and never yaml if asked for json
+    """
+
+    if "fields" in args:
+        fields = {"id"} | set(args["fields"].split(","))
+    elif args.get("format") == "json":
+        fields = set(model.__table__.columns._data.keys())
+    else:
+        return None
+
+    if args.get("format") == "json":
+        fields.discard("yaml")
+
+    return fields
+
+def expansion(model, args):
+    """
+    The relationships asked to be inlined, if the model has them
+    """
+
+    return {
+        name for name in args.get("expand", "").split(",")
+        if name in sqlalchemy.inspect(model).relationships.keys()
+    }
+
+def columns(model, fields):
+    """
+    The columns needed to output the fields, all if None
+    """
+
+    return [
+        column for column in model.__table__.columns._data.keys()
+        if fields is None or column in fields or (column == "data" and "yaml" in fields)
+    ]
+
+def render(model, data):
+    """
+    Dumps a model's data to yaml, reusing the last dump of the same data
+    """
+
+    data = dict(data)
+    key = (model.__tablename__, model.id, hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest())
+    rendered = renderings.get(key)
+
+    if rendered is None:
+        rendered = yaml.dump(data, Dumper=Dumper, default_flow_style=False)
+        renderings.set(key, rendered)
+
+    return rendered
+
+def model_out(model, fields=None, expand=None):
 
     converted = {}
 
-    for field in model.__table__.columns._data.keys():
+    for field in columns(model, fields):
+
+        value = getattr(model, field)
 
-        converted[field] = getattr(model, field)
+        if fields is None or field in fields:
+            converted[field] = value
 
-        if field == "data":
-            converted["yaml"] = yaml.safe_dump(dict(converted[field]), default_flow_style=False)
+        if field == "data" and (fields is None or "yaml" in fields):
+            converted["yaml"] = render(model, value)
+
+    for name in expand or []:
+        converted[name] = model_out(getattr(model, name))
 
     return converted
 
-def models_out(models):
+def models_out(models, fields=None, expand=None):
+
+    return [model_out(model, fields, expand) for model in models]
+
+
+def etag(*parts):
+    """
+    A strong entity tag for whatever the parts are
+    """
+
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+def unchanged(tag):
+    """
+    Whether the client already has what's tagged
+    """
+
+    return tag is not None and flask.request.if_none_match.contains(tag)
+
+def not_modified(tag):
+
+    response = flask.make_response("", 304)
+    response.set_etag(tag)
+
+    return response
+
+def tagged(response, tag=None):
+    """
+    Tags a response, by what's in it if it isn't tagged already, answering
+    304 instead if the client already has it
+    """
+
+    if tag is None:
+        tag = etag(response)
 
-    return [model_out(model) for model in models]
+    if unchanged(tag):
+        return not_modified(tag)
 
+    return response, 200, {"ETag": werkzeug.http.quote_etag(tag)}
+
+def commit():
+    """
+    Commits, unless in a batch, where it only flushes so the batch can still
+    undo just the action it's part of
+    """
+
+    if getattr(flask.request, "batch", False) is True:
+        flask.request.session.flush()
+    else:
+        flask.request.session.commit()
 
 def notify(message):
 
@@ -152,32 +492,91 @@ class Model:
         return validate(fields)
 
     @classmethod
-    def retrieve(self, id):
+    def retrieve(self, id, fields=None):
 
-        model = flask.request.session.query(
+        query = flask.request.session.query(
             self.MODEL
-        ).get(
+        )
+
+        if fields is not None:
+            query = query.options(sqlalchemy.orm.load_only(*columns(self.MODEL, fields)))
+
+        model = query.get(
             id
         )
 
-        flask.request.session.commit()
+        commit()
         return model
 
+    @classmethod
+    def version(cls, models):
+        """
+        Tags the models by how many there are and when they were last updated,
+        without loading them, if that can be trusted to change when they do
+        """
+
+        # People come along expanded, and they don't keep when they were updated
+
+        if not hasattr(cls.MODEL, "updated") or "expand" in flask.request.args:
+            return None
+
+        (count, updated) = models.with_entities(
+            sqlalchemy.func.count(cls.MODEL.id),
+            sqlalchemy.func.max(cls.MODEL.updated)
+        ).one()
+
+        # Updated only has seconds, so anything updated this second could change
+        # again without changing it
+
+        if updated is not None and updated >= int(time.time()):
+            return None
+
+        return etag(flask.request.path, flask.request.args.to_dict(), count, updated)
+
 class RestCL(flask_restful.Resource):
 
+    @classmethod
+    def schema(cls):
+
+        if cls not in schemas:
+            schemas[cls] = Schema(cls.FIELDS)
+
+        return schemas[cls]
+
     @classmethod
     def fields(cls, values=None, originals=None):
 
-        return opengui.Fields(values, originals=originals, fields=copy.deepcopy(cls.FIELDS))
+        return opengui.Fields(values, originals=originals, fields=cls.schema().overlay())
+
+    @classmethod
+    def listing(cls):
+        """
+        The fields without values, serialized once until the people or templates
+        they offer change
+        """
+
+        text = memoize(
+            ("person", "template"),
+            (cls, tuple(sorted(flask.request.args.to_dict().items()))),
+            lambda: json.dumps({"fields": cls.fields().to_list()})
+        )
+
+        response = flask.make_response(text)
+        response.headers.set('Content-Type', 'application/json')
+
+        return response
 
     @require_session
     def options(self):
 
         values = flask.request.json[self.SINGULAR] if flask.request.json and self.SINGULAR in flask.request.json else None
 
+        if values is None:
+            return self.listing()
+
         fields = self.fields(values)
 
-        if values is not None and not self.validate(fields):
+        if not self.validate(fields):
             return {"fields": fields.to_list(), "errors": fields.errors}
         else:
             return {"fields": fields.to_list()}
@@ -191,19 +590,146 @@ class RestCL(flask_restful.Resource):
 
         return {self.SINGULAR: model_out(model)}, 201
 
+    @classmethod
+    def keys(cls):
+        """
+        The columns a list is ordered by, and whether descending, with id last to break ties
+        """
+
+        keys = []
+
+        for order in cls.ORDER:
+            if isinstance(order, sqlalchemy.sql.elements.UnaryExpression):
+                keys.append((order.element, order.modifier is sqlalchemy.sql.operators.desc_op))
+            else:
+                keys.append((order, False))
+
+        keys.append((cls.MODEL.id, keys[0][1]))
+
+        return keys
+
+    @staticmethod
+    def limit(value):
+        """
+        How many to a page, which has to be at least one
+        """
+
+        try:
+            limit = int(value)
+        except (TypeError, ValueError):
+            limit = None
+
+        if limit is None or limit < 1:
+            raise werkzeug.exceptions.BadRequest(f"limit must be a whole number of at least 1, not {value!r}")
+
+        return limit
+
+    @classmethod
+    def cursor(cls, value):
+        """
+        The key values of the last model of the previous page, as long as they're
+        what this list's ordered by
+        """
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(value.encode()))
+        except (TypeError, ValueError):
+            values = None
+
+        keys = cls.keys()
+
+        if not isinstance(values, list) or len(values) != len(keys) or not all(
+            isinstance(key, (int, float)) and not isinstance(key, bool)
+            if column.type.python_type in (int, float) else isinstance(key, column.type.python_type)
+            for (key, (column, descending)) in zip(values, keys)
+        ):
+            raise werkzeug.exceptions.BadRequest(f"invalid cursor for {cls.PLURAL}")
+
+        return values
+
+    @classmethod
+    def page(cls, models, limit=None, cursor=None, fields=None, expand=None):
+        """
+        Lists the models, if limited or continuing, as a page starting after the cursor
+        and the cursor for the page after, if there is one, loading only what's needed
+        for the fields and joining in what's expanded
+        """
+
+        keys = cls.keys()
+
+        if limit is not None:
+            limit = cls.limit(limit)
+
+        if cursor is not None:
+            values = cls.cursor(cursor)
+
+        if fields is not None:
+            models = models.options(sqlalchemy.orm.load_only(
+                *columns(cls.MODEL, fields | {column.key for (column, descending) in keys})
+            ))
+
+        for name in expand or []:
+            models = models.options(sqlalchemy.orm.joinedload(getattr(cls.MODEL, name)))
+
+        if limit is None and cursor is None:
+            return {cls.PLURAL: models_out(models.order_by(*cls.ORDER).all(), fields, expand)}
+
+        models = models.order_by(*[column.desc() if descending else column for (column, descending) in keys])
+
+        # Pick up right after the last model of the previous page
+
+        if cursor is not None:
+
+            models = models.filter(sqlalchemy.or_(*[
+                sqlalchemy.and_(
+                    *[keys[prior][0] == values[prior] for prior in range(index)],
+                    column < values[index] if descending else column > values[index]
+                )
+                for (index, (column, descending)) in enumerate(keys)
+            ]))
+
+        if limit is None:
+            return {cls.PLURAL: models_out(models.all(), fields, expand), "cursor": None}
+
+        models = models.limit(limit + 1).all()
+
+        if len(models) <= limit:
+            return {cls.PLURAL: models_out(models, fields, expand), "cursor": None}
+
+        models = models[:limit]
+        last = [getattr(models[-1], column.key) for (column, descending) in keys]
+
+        return {cls.PLURAL: models_out(models, fields, expand), "cursor": base64.urlsafe_b64encode(json.dumps(last).encode()).decode()}
+
+    @cached
     @require_session
     def get(self):
 
+        filter_by = flask.request.args.to_dict()
+        fields = projection(self.MODEL, filter_by)
+        expand = expansion(self.MODEL, filter_by)
+        filter_by.pop("fields", None)
+        filter_by.pop("format", None)
+        filter_by.pop("expand", None)
+        limit = filter_by.pop("limit", None)
+        cursor = filter_by.pop("cursor", None)
+
         models = flask.request.session.query(
             self.MODEL
         ).filter_by(
-            **flask.request.args.to_dict()
-        ).order_by(
-            *self.ORDER
-        ).all()
+            **filter_by
+        )
+
+        tag = self.version(models)
+
+        if unchanged(tag):
+            flask.request.session.commit()
+            return not_modified(tag)
+
+        response = self.page(models, limit, cursor, fields, expand)
         flask.request.session.commit()
 
-        return {self.PLURAL: models_out(models)}
+        return tagged(response, tag)
 
 class RestRUD(flask_restful.Resource):
 
@@ -214,10 +740,18 @@ class RestRUD(flask_restful.Resource):
         }
     ]
 
+    @classmethod
+    def schema(cls):
+
+        if cls not in schemas:
+            schemas[cls] = Schema(cls.ID + cls.FIELDS)
+
+        return schemas[cls]
+
     @classmethod
     def fields(cls, values=None, originals=None):
 
-        return opengui.Fields(values, originals=originals, fields=copy.deepcopy(cls.ID + cls.FIELDS))
+        return opengui.Fields(values, originals=originals, fields=cls.schema().overlay())
 
     @require_session
     def options(self, id):
@@ -233,21 +767,49 @@ class RestRUD(flask_restful.Resource):
         else:
             return {"fields": fields.to_list()}
 
+    @cached
     @require_session
     def get(self, id):
 
-        return {self.SINGULAR: model_out(self.retrieve(id))}
+        tag = self.version(flask.request.session.query(
+            self.MODEL
+        ).filter_by(
+            id=id
+        ))
+
+        if unchanged(tag):
+            flask.request.session.commit()
+            return not_modified(tag)
+
+        fields = projection(self.MODEL, flask.request.args)
+
+        return tagged({self.SINGULAR: model_out(self.retrieve(id, fields), fields)}, tag)
 
     @require_session
     def patch(self, id):
 
-        rows = flask.request.session.query(
+        # Update through the models so any derived columns are kept current
+
+        rows = 0
+
+        for model in flask.request.session.query(
             self.MODEL
         ).filter_by(
             id=id
-        ).update(
-            model_in(flask.request.json[self.SINGULAR])
-        )
+        ).all():
+
+            fields = model_in(flask.request.json[self.SINGULAR])
+
+            for field, value in fields.items():
+                setattr(model, field, value)
+
+            # So it's tagged differently
+
+            if hasattr(model, "updated") and "updated" not in fields:
+                model.updated = time.time()
+
+            rows += 1
+
         flask.request.session.commit()
 
         return {"updated": rows}, 202
@@ -286,22 +848,28 @@ class Person(Model):
     @classmethod
     def choices(cls):
 
-        ids = []
-        labels = {}
+        filter_by = flask.request.args.to_dict()
 
-        for model in flask.request.session.query(
-            cls.MODEL
-        ).filter_by(
-            **flask.request.args.to_dict()
-        ).order_by(
-            *cls.ORDER
-        ).all():
-            ids.append(model.id)
-            labels[model.id] = model.name
+        def load():
 
-        flask.request.session.commit()
+            ids = []
+            labels = {}
+
+            for model in flask.request.session.query(
+                cls.MODEL
+            ).filter_by(
+                **filter_by
+            ).order_by(
+                *cls.ORDER
+            ).all():
+                ids.append(model.id)
+                labels[model.id] = model.name
+
+            flask.request.session.commit()
+
+            return (ids, labels)
 
-        return (ids, labels)
+        return memoize((cls.MODEL.__tablename__,), tuple(sorted(filter_by.items())), load)
 
 class PersonCL(Person, RestCL):
     pass
@@ -340,22 +908,26 @@ class Template(Model):
     @classmethod
     def choices(cls, kind):
 
-        ids = [0]
-        labels = {0: "None"}
+        def load():
 
-        for model in flask.request.session.query(
-            cls.MODEL
-        ).filter_by(
-            kind=kind
-        ).order_by(
-            *cls.ORDER
-        ).all():
-            ids.append(model.id)
-            labels[model.id] = model.name
+            ids = [0]
+            labels = {0: "None"}
 
-        flask.request.session.commit()
+            for model in flask.request.session.query(
+                cls.MODEL
+            ).filter_by(
+                kind=kind
+            ).order_by(
+                *cls.ORDER
+            ).all():
+                ids.append(model.id)
+                labels[model.id] = model.name
+
+            flask.request.session.commit()
 
-        return (ids, labels)
+            return (ids, labels)
+
+        return memoize((cls.MODEL.__tablename__,), kind, load)
 
 class TemplateCL(Template, RestCL):
     pass
@@ -450,7 +1022,7 @@ class Status(Model):
 
         model = cls.MODEL(**cls.build(**kwargs))
         flask.request.session.add(model)
-        flask.request.session.commit()
+        commit()
 
         cls.notify("create", model)
 
@@ -459,43 +1031,60 @@ class Status(Model):
 
 class StatusCL(RestCL):
 
+    @classmethod
+    def schema(cls):
+
+        if cls not in schemas:
+            schemas[cls] = Schema([
+                {
+                    "name": "person_id",
+                    "label": "person",
+                    "options": [],
+                    "labels": {},
+                    "style": "radios"
+                },
+                {
+                    "name": "status",
+                    "options": cls.STATUSES,
+                    "style": "radios"
+                },
+                {
+                    "name": "template_id",
+                    "label": "template",
+                    "options": [],
+                    "labels": {},
+                    "style": "select",
+                    "optional": True,
+                    "trigger": True
+                },
+                {
+                    "name": "name"
+                },
+                {
+                    "name": "yaml",
+                    "style": "textarea",
+                    "optional": True
+                }
+            ])
+
+        return schemas[cls]
+
     @classmethod
     def fields(cls, values=None, originals=None):
 
         (person_ids, person_labels) = Person.choices()
         (template_ids, template_labels) = Template.choices(cls.SINGULAR)
 
-        fields = opengui.Fields(values, originals=originals, fields=[
-            {
-                "name": "person_id",
-                "label": "person",
+        fields = opengui.Fields(values, originals=originals, fields=cls.schema().overlay(
+            person_id={
                 "options": person_ids,
-                "labels": person_labels,
-                "style": "radios"
-            },
-            {
-                "name": "status",
-                "options": cls.STATUSES,
-                "style": "radios"
+                "labels": person_labels
             },
-            {
-                "name": "template_id",
-                "label": "template",
+            template_id={
                 "options": template_ids,
-                "labels": template_labels,
-                "style": "select",
-                "optional": True,
-                "trigger": True
-            },
-            {
-                "name": "name"
-            },
-            {
-                "name": "yaml",
-                "style": "textarea",
-                "optional": True
+                "labels": template_labels
             }
-        ])
+        ))
 
         if fields["template_id"].value:
 
@@ -513,15 +1102,24 @@ class StatusCL(RestCL):
 
         return {self.SINGULAR: model_out(model)}, 201
 
+    @cached
     @require_session
     def get(self):
 
         since = None
+        limit = None
+        cursor = None
         filter_by = {}
 
         for name, value in flask.request.args.to_dict().items():
             if name == "since":
                 since = float(value)
+            elif name == "limit":
+                limit = value
+            elif name == "cursor":
+                cursor = value
+            elif name in ["fields", "format", "expand"]:
+                pass
             else:
                 filter_by[name] = value
 
@@ -536,66 +1134,102 @@ class StatusCL(RestCL):
                 self.MODEL.updated>time.time()-since*60*60*24
             )
 
-        models = models.order_by(
-            *self.ORDER
-        ).all()
+        tag = self.version(models)
 
+        if unchanged(tag):
+            flask.request.session.commit()
+            return not_modified(tag)
+
+        response = self.page(
+            models, limit, cursor,
+            projection(self.MODEL, flask.request.args),
+            expansion(self.MODEL, flask.request.args)
+        )
         flask.request.session.commit()
 
-        return {self.PLURAL: models_out(models)}
+        return tagged(response, tag)
 
 class StatusRUD(RestRUD):
 
+    @classmethod
+    def schema(cls):
+
+        if cls not in schemas:
+            schemas[cls] = Schema(cls.ID + [
+                {
+                    "name": "person_id",
+                    "label": "person",
+                    "options": [],
+                    "labels": {},
+                    "style": "radios"
+                },
+                {
+                    "name": "status",
+                    "options": cls.STATUSES,
+                    "style": "radios"
+                },
+                {
+                    "name": "name"
+                },
+                {
+                    "name": "created",
+                    "style": "datetime",
+                    "readonly": True
+                },
+                {
+                    "name": "updated",
+                    "style": "datetime",
+                    "readonly": True
+                },
+                {
+                    "name": "yaml",
+                    "style": "textarea",
+                    "optional": True
+                }
+            ])
+
+        return schemas[cls]
+
     @classmethod
     def fields(cls, values=None, originals=None):
 
         (person_ids, person_labels) = Person.choices()
 
-        fields = opengui.Fields(values, originals=originals, fields=cls.ID + [
-            {
-                "name": "person_id",
-                "label": "person",
+        return opengui.Fields(values, originals=originals, fields=cls.schema().overlay(
+            person_id={
                 "options": person_ids,
-                "labels": person_labels,
-                "style": "radios"
-            },
-            {
-                "name": "status",
-                "options": cls.STATUSES,
-                "style": "radios"
-            },
-            {
-                "name": "name"
-            },
-            {
-                "name": "created",
-                "style": "datetime",
-                "readonly": True
-            },
-            {
-                "name": "updated",
-                "style": "datetime",
-                "readonly": True
-            },
-            {
-                "name": "yaml",
-                "style": "textarea",
-                "optional": True
+                "labels": person_labels
             }
-        ])
-
-        return fields
+        ))
 
 class StatusA(flask_restful.Resource):
 
+    @classmethod
+    def apply(cls, id, action, notified=None):
+        """
+        Applies an action to a model without committing, unless it's been
+        notified since the caller saw it
+        """
+
+        # Actions notify with the person, so join it in rather than loading it after
+
+        model = flask.request.session.query(
+            cls.MODEL
+        ).options(
+            sqlalchemy.orm.joinedload(cls.MODEL.person)
+        ).get(id)
+
+        if notified is not None and model.data.get("notified") != notified:
+            return False
+
+        return getattr(cls, action)(model)
+
     @require_session
     def patch(self, id, action):
 
-        model = flask.request.session.query(self.MODEL).get(id)
-
         if action in self.ACTIONS:
 
-            updated = getattr(self, action)(model)
+            updated = self.apply(id, action, (flask.request.get_json(silent=True) or {}).get("notified"))
 
             if updated:
                 flask.request.session.commit()
@@ -658,7 +1292,7 @@ class Area(Value):
             cls.notify("wrong", model)
 
             if "todo" in model.data:
-                ToDo.create(person_id=model.person.id, data={"area": model.id}, template=model.data["todo"])
+                ToDo.create(person_id=model.person_id, data={"area": model.id}, template=model.data["todo"])
 
             return True
 
@@ -685,7 +1319,7 @@ class Act(Value):
 
         model = cls.MODEL(**cls.build(**kwargs))
         flask.request.session.add(model)
-        flask.request.session.commit()
+        commit()
 
         cls.notify("create", model)
 
@@ -699,7 +1333,7 @@ class Act(Value):
                 template["name"] = model.name
                 template["act"] = True
 
-            ToDo.create(person_id=model.person.id, status="opened", template=template)
+            ToDo.create(person_id=model.person_id, status="opened", template=template)
 
         return model
 
@@ -939,7 +1573,7 @@ class ToDo(State):
                     del template["notified"]
                     template["name"] = model.name
 
-                Act.create(person_id=model.person.id, status="positive", template=template)
+                Act.create(person_id=model.person_id, status="positive", template=template)
 
             return True
 
@@ -1042,13 +1676,13 @@ class Routine(State):
 
         model = cls.MODEL(**cls.tasks(cls.build(**kwargs)))
         flask.request.session.add(model)
-        flask.request.session.commit()
+        commit()
 
         model.data["start"] = time.time()
         cls.notify("create", model)
 
         cls.check(model)
-        flask.request.session.commit()
+        commit()
 
         return model
 
@@ -1082,6 +1716,49 @@ class RoutineCL(Routine, StatusCL):
 class RoutineRUD(Routine, StatusRUD):
     pass
 
+class RoutineDue(Routine, flask_restful.Resource):
+
+    @require_session
+    def get(self):
+        """
+        Lists the opened routines that need expiring or reminding as of at
+        (default now), with when the next one after that will be due
+        """
+
+        at = float(flask.request.args.get("at", time.time()))
+        fields = projection(self.MODEL, flask.request.args)
+        expand = expansion(self.MODEL, flask.request.args)
+
+        models = flask.request.session.query(
+            self.MODEL
+        ).filter(
+            self.MODEL.status == "opened",
+            self.MODEL.due <= at
+        )
+
+        if fields is not None:
+            models = models.options(sqlalchemy.orm.load_only(*columns(self.MODEL, fields)))
+
+        for name in expand:
+            models = models.options(sqlalchemy.orm.joinedload(getattr(self.MODEL, name)))
+
+        models = models.order_by(
+            self.MODEL.due,
+            self.MODEL.id
+        ).all()
+
+        after = flask.request.session.query(
+            sqlalchemy.func.min(self.MODEL.due)
+        ).filter(
+            self.MODEL.status == "opened",
+            self.MODEL.due > at
+        ).scalar()
+
+        response = {self.PLURAL: models_out(models, fields, expand), "next": after}
+        flask.request.session.commit()
+
+        return response
+
 class RoutineA(Routine, StatusA):
     pass
 
@@ -1238,17 +1915,93 @@ class Task:
 
 class TaskA(Task, flask_restful.Resource):
 
-    @require_session
-    def patch(self, routine_id, task_id, action):
+    @classmethod
+    def apply(cls, routine_id, task_id, action, notified=None):
+        """
+        Applies an action to a routine's task without committing, unless the
+        task's been notified since the caller saw it
+        """
 
-        routine = flask.request.session.query(mysql.Routine).get(routine_id)
+        routine = flask.request.session.query(
+            mysql.Routine
+        ).options(
+            sqlalchemy.orm.joinedload(mysql.Routine.person)
+        ).get(routine_id)
         task = routine.data["tasks"][task_id]
 
+        if notified is not None and task.get("notified") != notified:
+            return False
+
+        return getattr(cls, action)(task, routine)
+
+    @require_session
+    def patch(self, routine_id, task_id, action):
+
         if action in self.ACTIONS:
 
-            updated = getattr(self, action)(task, routine)
+            updated = self.apply(routine_id, task_id, action, (flask.request.get_json(silent=True) or {}).get("notified"))
 
             if updated:
                 flask.request.session.commit()
 
             return {"updated": updated}, 202
+
+
+class Batch(flask_restful.Resource):
+
+    KINDS = {
+        "area": AreaA,
+        "act": ActA,
+        "todo": ToDoA,
+        "routine": RoutineA,
+        "task": TaskA
+    }
+
+    @require_session
+    def patch(self):
+        """
+        Applies a list of actions in one session and commit, each in its own
+        savepoint so a failure only undoes itself, returning a result for each
+        """
+
+        # Actions that create things then only flush, leaving the savepoint be
+
+        flask.request.batch = True
+
+        results = []
+
+        for operation in flask.request.json["actions"]:
+
+            resource = self.KINDS.get(operation.get("kind"))
+
+            if resource is None or operation.get("action") not in resource.ACTIONS:
+                results.append({"message": f"unknown action {operation.get('kind')} {operation.get('action')}"})
+                continue
+
+            savepoint = flask.request.session.begin_nested()
+
+            try:
+
+                if operation["kind"] == "task":
+                    updated = resource.apply(operation["id"], operation["task_id"], operation["action"], operation.get("notified"))
+                else:
+                    updated = resource.apply(operation["id"], operation["action"], operation.get("notified"))
+
+                savepoint.commit()
+                results.append({"updated": updated})
+
+            except Exception as exception:
+
+                # A failed flush leaves the savepoint inactive, but still to be rolled back
+
+                if savepoint is flask.request.session.transaction:
+                    savepoint.rollback()
+
+                if isinstance(exception, sqlalchemy.exc.IntegrityError):
+                    results.append({"message": conflict(exception)})
+                else:
+                    results.append({"message": str(exception)})
+
+        flask.request.session.commit()
+
+        return {"results": results}, 202
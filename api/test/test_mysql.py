@@ -5,6 +5,8 @@ import os
 import time
 import json
 import pymysql
+import sqlalchemy
+import sqlalchemy.exc
 
 import mysql
 
@@ -290,3 +292,143 @@ class TestMySQL(unittest.TestCase):
         self.session.commit()
         routine = self.session.query(mysql.Routine).one()
         self.assertEqual(routine.data, {"a": 2})
+        self.assertIsNone(routine.due)
+
+        routine.data["start"] = 1
+        routine.data["expires"] = 5
+        self.session.commit()
+        routine = self.session.query(mysql.Routine).one()
+        self.assertEqual(routine.due, 6)
+
+        routine.status = "closed"
+        self.session.commit()
+        routine = self.session.query(mysql.Routine).one()
+        self.assertIsNone(routine.due)
+
+    def test_deadline(self):
+
+        self.assertIsNone(mysql.deadline({
+            "start": 1
+        }))
+
+        # Not started or notified yet
+
+        self.assertIsNone(mysql.deadline({
+            "expires": 5,
+            "interval": 2
+        }))
+
+        self.assertEqual(mysql.deadline({
+            "delay": 7,
+            "interval": 2,
+            "notified": 4
+        }), 6)
+
+        self.assertEqual(mysql.deadline({
+            "start": 1,
+            "expires": 5
+        }), 6)
+
+        self.assertIsNone(mysql.deadline({
+            "start": 1,
+            "expires": 5
+        }, expire=False))
+
+        self.assertEqual(mysql.deadline({
+            "start": 1,
+            "delay": 7,
+            "interval": 2,
+            "notified": 4
+        }), 8)
+
+        self.assertIsNone(mysql.deadline({
+            "start": 1,
+            "interval": 2,
+            "notified": 4,
+            "paused": True
+        }))
+
+        self.assertEqual(mysql.deadline({
+            "start": 1,
+            "expires": 4,
+            "interval": 2,
+            "notified": 4
+        }), 5)
+
+    def test_Routine_deadline(self):
+
+        self.assertIsNone(mysql.Routine(data={}).deadline())
+
+        self.assertIsNone(mysql.Routine(status="closed", data={
+            "start": 1,
+            "expires": 5
+        }).deadline())
+
+        self.assertEqual(mysql.Routine(data={
+            "start": 1,
+            "expires": 8,
+            "tasks": [
+                {
+                    "start": 1,
+                    "end": 2,
+                    "interval": 1,
+                    "notified": 1
+                },
+                {
+                    "start": 2,
+                    "interval": 3,
+                    "notified": 4
+                }
+            ]
+        }).deadline(), 7)
+
+    def test_migrate(self):
+
+        person = mysql.Person(name="unit")
+        self.session.add(person)
+        self.session.commit()
+
+        for index in mysql.Routine.__table__.indexes:
+            if index.name == "routine_status_due":
+                index.drop(self.mysql.engine)
+
+        self.mysql.engine.execute("ALTER TABLE routine DROP COLUMN due")
+
+        for index in mysql.Act.__table__.indexes:
+            if index.name == "act_updated":
+                index.drop(self.mysql.engine)
+        self.mysql.engine.execute(
+            "INSERT INTO routine (person_id, name, status, created, updated, data) VALUES (%s, 'a', 'opened', 1, 1, '{\"start\": 1, \"expires\": 5}')" % person.id
+        )
+
+        mysql.migrate(self.mysql.engine)
+        mysql.migrate(self.mysql.engine)
+
+        routine = self.session.query(mysql.Routine).one()
+        self.assertEqual(routine.due, 6)
+
+        inspector = sqlalchemy.inspect(self.mysql.engine)
+
+        self.assertIn("routine_status_due", [index["name"] for index in inspector.get_indexes("routine")])
+        self.assertIn("act_updated", [index["name"] for index in inspector.get_indexes("act")])
+
+    def test_unique(self):
+
+        self.session.add(mysql.Template(name="unit", kind="todo"))
+        self.session.add(mysql.Template(name="unit", kind="act"))
+        self.session.commit()
+
+        self.session.add(mysql.Template(name="unit", kind="todo"))
+        self.assertRaises(sqlalchemy.exc.IntegrityError, self.session.commit)
+        self.session.rollback()
+
+        # Things are labeled by name, person and the second they were created
+
+        sample = Sample(self.session)
+
+        sample.todo("unit", "hey", created=7)
+        sample.todo("unit", "hey", created=8)
+        sample.todo("test", "hey", created=7)
+
+        self.assertRaises(sqlalchemy.exc.IntegrityError, sample.todo, "unit", "hey", created=7)
+        self.session.rollback()
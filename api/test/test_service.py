@@ -3,11 +3,15 @@ import unittest.mock
 
 import os
 import json
+import base64
 import yaml
+import collections
 
 import flask
+import redis
 import opengui
 import sqlalchemy.exc
+import sqlalchemy.event
 
 import mysql
 import test_mysql
@@ -23,12 +27,29 @@ class MockRedis(object):
         self.channel = None
 
         self.messages = []
+        self.values = {}
+        self.expires = {}
 
     def publish(self, channel, message):
 
         self.channel = channel
         self.messages.append(message)
 
+    def get(self, key):
+
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+
+        self.values[key] = str(value).encode()
+        self.expires[key] = ex
+
+    def incr(self, key):
+
+        self.values[key] = str(int(self.values.get(key, 0)) + 1).encode()
+
+        return int(self.values[key])
+
 class TestRest(unittest.TestCase):
 
     maxDiff = None
@@ -56,6 +77,8 @@ class TestRest(unittest.TestCase):
         self.session = self.app.mysql.session()
         self.sample = test_mysql.Sample(self.session)
 
+        service.choosings.values.clear()
+
         mysql.Base.metadata.create_all(self.app.mysql.engine)
 
     def tearDown(self):
@@ -63,6 +86,23 @@ class TestRest(unittest.TestCase):
         self.session.close()
         mysql.drop_database()
 
+    def statements(self, call):
+        """
+        Makes the call, returning it and the SQL it ran
+        """
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(self.app.mysql.engine, "before_cursor_execute", record)
+
+        try:
+            return (call(), statements)
+        finally:
+            sqlalchemy.event.remove(self.app.mysql.engine, "before_cursor_execute", record)
+
     def assertStatusFields(self, response, code, fields, errors=None):
 
         self.assertEqual(response.status_code, code, response.json)
@@ -313,6 +353,100 @@ class TestService(TestRest):
             }
         })
 
+    def test_projection(self):
+
+        self.assertIsNone(service.projection(mysql.Area, {}))
+        self.assertEqual(service.projection(mysql.Area, {"fields": "name,yaml"}), {"id", "name", "yaml"})
+        self.assertEqual(service.projection(mysql.Area, {"fields": "name,yaml", "format": "json"}), {"id", "name"})
+        self.assertEqual(service.projection(mysql.Area, {"format": "json"}), {
+            "id", "person_id", "name", "status", "created", "updated", "data"
+        })
+
+    def test_expansion(self):
+
+        self.assertEqual(service.expansion(mysql.Area, {}), set())
+        self.assertEqual(service.expansion(mysql.Area, {"expand": "person,nope"}), {"person"})
+        self.assertEqual(service.expansion(mysql.Person, {"expand": "person"}), set())
+
+    def test_cache(self):
+
+        cache = service.Cache(2)
+
+        self.assertIsNone(cache.get("a"))
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+
+        cache.set("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_yaml(self):
+
+        if yaml.__with_libyaml__:
+            self.assertEqual(service.Loader, yaml.CSafeLoader)
+            self.assertEqual(service.Dumper, yaml.CSafeDumper)
+        else:
+            self.assertEqual(service.Loader, yaml.SafeLoader)
+            self.assertEqual(service.Dumper, yaml.SafeDumper)
+
+    @unittest.mock.patch("service.parsings", service.Cache(2))
+    def test_parse(self):
+
+        with unittest.mock.patch("yaml.load", wraps=yaml.load) as mock_load:
+
+            parsed = service.parse("a: 1")
+            self.assertEqual(parsed, {"a": 1})
+
+            # Same text isn't parsed again, and changing what came back doesn't change the next
+
+            parsed["a"] = 2
+            self.assertEqual(service.parse("a: 1"), {"a": 1})
+            mock_load.assert_called_once_with("a: 1", Loader=service.Loader)
+
+            self.assertEqual(service.parse("b: 2"), {"b": 2})
+            self.assertEqual(mock_load.call_count, 2)
+
+    @unittest.mock.patch("service.renderings", service.Cache(2))
+    def test_render(self):
+
+        area = self.sample.area("unit", name="a", data={"d": 4})
+        dumped = yaml.dump({"d": 4}, default_flow_style=False)
+        changed = yaml.dump({"d": 5}, default_flow_style=False)
+
+        with unittest.mock.patch("yaml.dump", wraps=yaml.dump) as mock_dump:
+
+            self.assertEqual(service.render(area, area.data), dumped)
+            self.assertEqual(service.render(area, {"d": 4}), dumped)
+            mock_dump.assert_called_once_with({"d": 4}, Dumper=service.Dumper, default_flow_style=False)
+
+            # Changed data's dumped again
+
+            self.assertEqual(service.render(area, {"d": 5}), changed)
+            self.assertEqual(mock_dump.call_count, 2)
+
+            # Only so many are kept, least recently used going first
+
+            service.render(area, {"d": 4})
+            service.render(area, {"d": 6})
+            self.assertEqual(mock_dump.call_count, 3)
+
+            service.render(area, {"d": 4})
+            self.assertEqual(mock_dump.call_count, 3)
+
+            service.render(area, {"d": 5})
+            self.assertEqual(mock_dump.call_count, 4)
+
+        self.assertEqual(len(service.renderings.values), 2)
+
+    def test_columns(self):
+
+        self.assertEqual(service.columns(mysql.Area, None), ["id", "person_id", "name", "status", "created", "updated", "data"])
+        self.assertEqual(service.columns(mysql.Area, {"id", "name"}), ["id", "name"])
+        self.assertEqual(service.columns(mysql.Area, {"id", "yaml"}), ["id", "data"])
+
     def test_model_out(self):
 
         area = self.sample.area(
@@ -337,6 +471,26 @@ class TestService(TestRest):
             "yaml": yaml.dump({"d": 4}, default_flow_style=False)
         })
 
+        self.assertEqual(service.model_out(area, {"id", "name"}), {
+            "id": area.id,
+            "name": "a"
+        })
+
+        self.assertEqual(service.model_out(area, {"id", "yaml"}), {
+            "id": area.id,
+            "yaml": yaml.dump({"d": 4}, default_flow_style=False)
+        })
+
+        self.assertEqual(service.model_out(area, {"id"}, {"person"}), {
+            "id": area.id,
+            "person": {
+                "id": area.person.id,
+                "name": "unit",
+                "data": {},
+                "yaml": "{}\n"
+            }
+        })
+
     def test_models_out(self):
 
         area = self.sample.area(
@@ -361,6 +515,155 @@ class TestService(TestRest):
             "yaml": yaml.dump({"d": 4}, default_flow_style=False)
         }])
 
+        self.assertEqual(service.models_out([area], {"status"}), [{
+            "status": "positive"
+        }])
+
+        self.assertEqual(service.models_out([area], {"status"}, {"person"}), [{
+            "status": "positive",
+            "person": service.model_out(area.person)
+        }])
+
+    def test_flushed(self):
+
+        self.sample.person("unit")
+        self.assertEqual(self.session.info["changed"], {"person"})
+
+        self.session.info["changed"] = set()
+        self.sample.area("unit", "test")
+        self.assertEqual(self.session.info["changed"], {"area"})
+
+        self.session.info["changed"] = set()
+        self.session.query(mysql.Area).filter_by(name="test").delete()
+        self.assertEqual(self.session.info["changed"], {"area"})
+
+    def test_committed(self):
+
+        version = service.versions["person"]
+
+        self.sample.person("unit")
+        self.assertEqual(service.versions["person"], version + 1)
+
+    @unittest.mock.patch("service.time.time")
+    def test_memoize(self, mock_time):
+
+        mock_time.return_value = 7
+        load = unittest.mock.MagicMock(return_value=([1], {1: "unit"}))
+
+        (ids, labels) = service.memoize(("person",), "key", load)
+        self.assertEqual((ids, labels), ([1], {1: "unit"}))
+
+        # Remembered, and what's handed out can be changed freely
+
+        ids.append(2)
+        self.assertEqual(service.memoize(("person",), "key", load), ([1], {1: "unit"}))
+        load.assert_called_once_with()
+
+        self.assertEqual(service.memoize(("person",), "other", load), ([1], {1: "unit"}))
+        self.assertEqual(load.call_count, 2)
+
+        # Loaded again once changed
+
+        service.versions["person"] += 1
+        service.memoize(("person",), "key", load)
+        self.assertEqual(load.call_count, 3)
+
+        service.memoize(("person", "template"), "key", load)
+        service.memoize(("person", "template"), "key", load)
+        self.assertEqual(load.call_count, 4)
+
+        service.versions["template"] += 1
+        service.memoize(("person", "template"), "key", load)
+        self.assertEqual(load.call_count, 5)
+
+        # or stale
+
+        mock_time.return_value = 7 + service.CHOICES_TTL + 1
+        service.memoize(("person",), "key", load)
+        self.assertEqual(load.call_count, 6)
+
+    def test_schema(self):
+
+        fields = [{"name": "a", "options": [1]}, {"name": "b"}]
+        schema = service.Schema(fields)
+
+        # Compiled from a copy, so changing what it came from doesn't change it
+
+        fields[0]["name"] = "c"
+
+        overlaid = schema.overlay(a={"options": [2], "labels": {2: "two"}})
+        self.assertEqual(overlaid, [{"name": "a", "options": [2], "labels": {2: "two"}}, {"name": "b"}])
+
+        overlaid[1]["style"] = "textarea"
+        self.assertEqual(schema.overlay(), [{"name": "a", "options": [1]}, {"name": "b"}])
+
+    @unittest.mock.patch("flask.current_app")
+    def test_invalidate(self, mock_app):
+
+        mock_app.channel = "stuff"
+        mock_app.cache = 0
+
+        service.invalidate({"area"})
+        mock_app.redis.incr.assert_not_called()
+
+        mock_app.cache = 60
+
+        service.invalidate(set())
+        mock_app.redis.incr.assert_not_called()
+
+        service.invalidate({"area", "act"})
+        mock_app.redis.incr.assert_has_calls([
+            unittest.mock.call("stuff/cache/act"),
+            unittest.mock.call("stuff/cache/area")
+        ])
+
+        mock_app.redis.incr.reset_mock()
+
+        service.invalidate({"person"})
+        mock_app.redis.incr.assert_has_calls([
+            unittest.mock.call(f"stuff/cache/{kind}") for kind in sorted(["person", "template", "area", "act", "todo", "routine"])
+        ])
+
+        mock_app.redis.incr.side_effect = redis.exceptions.ConnectionError("nope")
+        service.invalidate({"area"})
+
+    def test_etag(self):
+
+        self.assertEqual(service.etag("a", {"b": 1, "c": 2}), service.etag("a", {"c": 2, "b": 1}))
+        self.assertNotEqual(service.etag("a", 1), service.etag("a", 2))
+
+    def test_unchanged(self):
+
+        with self.app.test_request_context(headers={"If-None-Match": '"abc"'}):
+            self.assertTrue(service.unchanged("abc"))
+            self.assertFalse(service.unchanged("def"))
+            self.assertFalse(service.unchanged(None))
+
+        with self.app.test_request_context():
+            self.assertFalse(service.unchanged("abc"))
+
+    def test_not_modified(self):
+
+        with self.app.test_request_context():
+
+            response = service.not_modified("abc")
+
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], '"abc"')
+            self.assertEqual(response.data, b"")
+
+    def test_tagged(self):
+
+        with self.app.test_request_context():
+
+            self.assertEqual(service.tagged({"a": 1}, "abc"), ({"a": 1}, 200, {"ETag": '"abc"'}))
+            self.assertEqual(service.tagged({"a": 1}), ({"a": 1}, 200, {"ETag": f'"{service.etag({"a": 1})}"'}))
+
+        with self.app.test_request_context(headers={"If-None-Match": f'"{service.etag({"a": 1})}"'}):
+
+            self.assertEqual(service.tagged({"a": 1}).status_code, 304)
+            self.assertEqual(service.tagged({"a": 2})[1], 200)
+
     @unittest.mock.patch("flask.current_app")
     def test_notify(self, mock_request):
 
@@ -446,6 +749,16 @@ class TestPerson(TestRest):
         self.assertEqual(ids, [test.id, unit.id])
         self.assertEqual(labels, {test.id: "test", unit.id: "unit"})
 
+        # Remembered until people change
+
+        with unittest.mock.patch.object(self.session, "query") as mock_query:
+            self.assertEqual(service.Person.choices(), (ids, labels))
+            mock_query.assert_not_called()
+
+        rest = self.sample.person("rest")
+
+        self.assertEqual(service.Person.choices()[0], [rest.id, test.id, unit.id])
+
 class TestPersonCL(TestRest):
 
     def test_fields(self):
@@ -539,6 +852,55 @@ class TestPersonCL(TestRest):
                 "name": "unit"
             }
         ])
+        self.assertNotIn("cursor", self.api.get("/person").json)
+
+        # paged
+
+        self.sample.person("zoo")
+
+        response = self.api.get("/person?limit=2")
+        self.assertStatusModels(response, 200, "persons", [
+            {
+                "name": "test"
+            },
+            {
+                "name": "unit"
+            }
+        ])
+        self.assertEqual(len(response.json["persons"]), 2)
+
+        response = self.api.get(f"/person?limit=2&cursor={response.json['cursor']}")
+        self.assertStatusModels(response, 200, "persons", [
+            {
+                "name": "zoo"
+            }
+        ])
+        self.assertEqual(len(response.json["persons"]), 1)
+        self.assertIsNone(response.json["cursor"])
+
+        # paged badly
+
+        for limit in ["0", "-1", "two"]:
+            response = self.api.get(f"/person?limit={limit}")
+            self.assertEqual(response.status_code, 400, response.json)
+            self.assertEqual(response.json["message"], f"limit must be a whole number of at least 1, not '{limit}'")
+
+        act = self.sample.act("unit", "hey")
+        act_cursor = base64.urlsafe_b64encode(json.dumps([act.created, act.id]).encode()).decode()
+        short_cursor = base64.urlsafe_b64encode(json.dumps(["unit"]).encode()).decode()
+
+        for cursor in ["garbage", "e30=", act_cursor, short_cursor]:
+            response = self.api.get(f"/person?limit=2&cursor={cursor}")
+            self.assertEqual(response.status_code, 400, response.json)
+            self.assertEqual(response.json["message"], "invalid cursor for persons")
+
+        # tagged by what's in it, since people don't keep updated
+
+        tag = self.api.get("/person").headers["ETag"]
+        self.assertEqual(self.api.get("/person", headers={"If-None-Match": tag}).status_code, 304)
+
+        self.sample.person("new")
+        self.assertEqual(self.api.get("/person", headers={"If-None-Match": tag}).status_code, 200)
 
 class TestPersonRUD(TestRest):
 
@@ -644,6 +1006,17 @@ class TestPersonRUD(TestRest):
             "name": "unit"
         })
 
+        self.assertStatusValue(self.api.get(f"/person/{person.id}?fields=name"), 200, "person", {
+            "id": person.id,
+            "name": "unit"
+        })
+
+        self.assertStatusValue(self.api.get(f"/person/{person.id}?format=json"), 200, "person", {
+            "id": person.id,
+            "name": "unit",
+            "data": {}
+        })
+
     def test_patch(self):
 
         person = self.sample.person("unit")
@@ -768,6 +1141,19 @@ class TestTemplate(TestRest):
         self.assertEqual(ids, [0, rest.id, unit.id])
         self.assertEqual(labels, {0: "None", rest.id: "rest", unit.id: "unit"})
 
+        # Remembered by kind until templates change
+
+        with unittest.mock.patch.object(self.session, "query") as mock_query:
+            self.assertEqual(service.Template.choices("todo"), (ids, labels))
+            mock_query.assert_not_called()
+
+        self.assertEqual(service.Template.choices("act")[0], [0, test.id])
+
+        self.session.delete(rest)
+        self.session.commit()
+
+        self.assertEqual(service.Template.choices("todo")[0], [0, unit.id])
+
 class TestTemplateCL(TestRest):
 
     def test_fields(self):
@@ -1396,6 +1782,30 @@ class TestArea(TestRest):
 
 class TestAreaCL(TestRest):
 
+    def test_schema(self):
+
+        self.assertIs(service.AreaCL.schema(), service.AreaCL.schema())
+        self.assertIsNot(service.AreaCL.schema(), service.ActCL.schema())
+        self.assertEqual(service.AreaCL.schema().fields[1]["options"], ["positive", "negative"])
+
+    def test_listing(self):
+
+        person = self.sample.person("unit")
+
+        response = self.api.options("/area")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["fields"][0]["options"], [person.id])
+
+        # Served as serialized until people or templates change
+
+        with unittest.mock.patch("service.AreaCL.fields") as mock_fields:
+            self.assertEqual(self.api.options("/area").json, response.json)
+            mock_fields.assert_not_called()
+
+        other = self.sample.person("test")
+
+        self.assertEqual(self.api.options("/area").json["fields"][0]["options"], [other.id, person.id])
+
     @unittest.mock.patch("flask.request")
     def test_fields(self, mock_request):
 
@@ -1643,6 +2053,104 @@ class TestAreaCL(TestRest):
             }
         ])
 
+    def test_get_cached(self):
+
+        self.app.cache = 60
+        self.app.redis.values = {}
+        self.app.redis.expires = {}
+
+        def entries():
+            generation = int(self.app.redis.get("stuff/cache/area") or 0)
+            return [key for key in self.app.redis.values if key.startswith(f"stuff/cache/area/{generation}/")]
+
+        try:
+
+            area = self.sample.area("unit", "test")
+
+            response = self.api.get("/area")
+            self.assertEqual([model["name"] for model in response.json["areas"]], ["test"])
+            self.assertEqual([self.app.redis.expires[key] for key in entries()], [60])
+            tag = response.headers["ETag"]
+
+            # Served from the cache, even if changed behind the API's back
+
+            self.sample.area("unit", "sneaky")
+
+            response = self.api.get("/area")
+            self.assertEqual([model["name"] for model in response.json["areas"]], ["test"])
+            self.assertEqual(response.headers["ETag"], tag)
+            self.assertEqual(self.api.get("/area", headers={"If-None-Match": tag}).status_code, 304)
+
+            # Different queries are cached separately and anything relative to now isn't
+
+            self.assertEqual(len(self.api.get("/area?status=positive").json["areas"]), 2)
+            self.assertEqual(len(self.api.get("/area?since=100000").json["areas"]), 2)
+            self.assertEqual(len(entries()), 2)
+
+            # Changing through the API moves past what's cached
+
+            self.api.patch(f"/area/{area.id}", json={"area": {"status": "negative"}})
+            self.assertEqual(entries(), [])
+
+            self.assertEqual(len(self.api.get("/area").json["areas"]), 2)
+            self.assertEqual(self.api.get(f"/area/{area.id}").json["area"]["status"], "negative")
+            self.assertEqual(len(entries()), 2)
+
+            self.api.delete(f"/area/{area.id}")
+            self.assertEqual(entries(), [])
+
+            # A response that raced a change is cached where it'll never be read
+
+            get = self.app.redis.get
+
+            def racing(key):
+                value = get(key)
+                if key == "stuff/cache/area":
+                    self.app.redis.incr(key)
+                return value
+
+            with unittest.mock.patch.object(self.app.redis, "get", side_effect=racing):
+                self.api.get("/area?status=positive")
+
+            self.assertEqual(entries(), [])
+
+        finally:
+
+            self.app.cache = 0
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=100))
+    def test_get_tagged(self):
+
+        area = self.sample.area("unit", "test")
+
+        response = self.api.get("/area")
+        self.assertEqual(response.status_code, 200)
+        tag = response.headers["ETag"]
+
+        with unittest.mock.patch("service.AreaCL.page") as mock_page:
+            response = self.api.get("/area", headers={"If-None-Match": tag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers["ETag"], tag)
+            mock_page.assert_not_called()
+
+        # Filters are tagged differently
+
+        self.assertNotEqual(self.api.get("/area?status=positive").headers["ETag"], tag)
+
+        # Changes change the tag
+
+        self.sample.area("unit", "more")
+        self.assertEqual(self.api.get("/area", headers={"If-None-Match": tag}).status_code, 200)
+
+        # Tagged by what's in it if updated this second
+
+        area.updated = 100
+        self.session.commit()
+
+        response = self.api.get("/area")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["ETag"], f'"{service.etag(response.json)}"')
+
 class TestAreaRUD(TestRest):
 
     @unittest.mock.patch("flask.request")
@@ -1871,6 +2379,30 @@ class TestAreaRUD(TestRest):
             "name": "test"
         })
 
+    def test_get_tagged(self):
+
+        area = self.sample.area("unit", "test")
+
+        response = self.api.get(f"/area/{area.id}")
+        tag = response.headers["ETag"]
+
+        response = self.api.get(f"/area/{area.id}", headers={"If-None-Match": tag})
+        self.assertEqual(response.status_code, 304)
+
+        self.assertNotEqual(self.api.get(f"/area/{area.id}?fields=name").headers["ETag"], tag)
+
+        # Patching bumps updated so the tag changes, once that second's past
+
+        with unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=100)):
+            self.api.patch(f"/area/{area.id}", json={"area": {"status": "negative"}})
+
+        with unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=101)):
+            response = self.api.get(f"/area/{area.id}", headers={"If-None-Match": tag})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["area"]["status"], "negative")
+        self.assertEqual(response.json["area"]["updated"], 100)
+
     def test_patch(self):
 
         area = self.sample.area("unit", "test")
@@ -2508,6 +3040,89 @@ class TestActCL(TestRest):
             }
         ])
 
+        # paged, ties broken by id
+
+        self.sample.act("unit", "first", created=5)
+        self.sample.act("unit", "second", created=5)
+        self.sample.act("unit", "third", created=5)
+        self.sample.act("unit", "last", created=3)
+
+        names = []
+        cursor = ""
+
+        while cursor is not None:
+
+            response = self.api.get(f"/act?person_id={self.sample.person('unit').id}&limit=2{cursor and '&cursor=' + cursor}")
+            self.assertEqual(response.status_code, 200, response.json)
+            self.assertLessEqual(len(response.json["acts"]), 2)
+
+            names.extend(act["name"] for act in response.json["acts"])
+            cursor = response.json["cursor"]
+
+        self.assertEqual(names, ["test", "third", "second", "first", "last"])
+
+        # paged badly, like with nothing to a page or an area's cursor
+
+        response = self.api.get("/act?limit=0")
+        self.assertEqual(response.status_code, 400, response.json)
+        self.assertEqual(response.json["message"], "limit must be a whole number of at least 1, not '0'")
+
+        self.sample.area("unit", "hey")
+        self.sample.area("unit", "you")
+        cursor = self.api.get("/area?limit=1").json["cursor"]
+        self.assertIsNotNone(cursor)
+
+        response = self.api.get(f"/act?limit=2&cursor={cursor}")
+        self.assertEqual(response.status_code, 400, response.json)
+        self.assertEqual(response.json["message"], "invalid cursor for acts")
+
+        # projected
+
+        response = self.api.get("/act?name=unit&fields=name,yaml")
+        self.assertStatusValue(response, 200, "acts", [
+            {
+                "id": response.json["acts"][0]["id"],
+                "name": "unit",
+                "yaml": "{}\n"
+            }
+        ])
+
+        response = self.api.get("/act?name=unit&format=json")
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertNotIn("yaml", response.json["acts"][0])
+        self.assertEqual(response.json["acts"][0]["data"], {})
+
+        response = self.api.get("/act?person_id=1&limit=2&fields=status")
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertEqual([sorted(act.keys()) for act in response.json["acts"]], [["id", "status"], ["id", "status"]])
+        self.assertIsNotNone(response.json["cursor"])
+
+        # expanded
+
+        (response, statements) = self.statements(lambda: self.api.get("/act?name=unit&fields=name&expand=person"))
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertEqual(response.json["acts"][0]["person"]["name"], "test")
+        self.assertEqual(sorted(response.json["acts"][0].keys()), ["id", "name", "person"])
+        self.assertTrue(any("JOIN person" in statement for statement in statements))
+
+        # not expanded, people stay out of it
+
+        (response, statements) = self.statements(lambda: self.api.get("/act?name=unit&fields=id,status"))
+        self.assertEqual(response.status_code, 200, response.json)
+        self.assertFalse(any("person" in statement for statement in statements), statements)
+
+    def test_keys(self):
+
+        self.assertEqual([(column.key, descending) for (column, descending) in service.ActCL.keys()], [
+            ("created", True),
+            ("id", True)
+        ])
+
+        self.assertEqual([(column.key, descending) for (column, descending) in service.PersonCL.keys()], [
+            ("name", False),
+            ("id", False)
+        ])
+
 class TestActRUD(TestRest):
 
     @unittest.mock.patch("flask.request")
@@ -2767,9 +3382,12 @@ class TestActA(TestRest):
 
         model = self.sample.act("unit", "hey")
 
-        # wrong
+        # wrong, with the person notified about joined in
 
-        self.assertStatusValue(self.api.patch(f"/act/{model.id}/wrong"), 202, "updated", True)
+        (response, statements) = self.statements(lambda: self.api.patch(f"/act/{model.id}/wrong"))
+        self.assertStatusValue(response, 202, "updated", True)
+        self.assertEqual(len([statement for statement in statements if "FROM person" in statement]), 0, statements)
+        self.assertEqual(len([statement for statement in statements if "JOIN person" in statement]), 1, statements)
         item = self.session.query(mysql.Act).get(model.id)
         self.session.commit()
         self.assertEqual(item.status, "negative")
@@ -3062,7 +3680,9 @@ class TestToDo(TestRest):
 
         person = self.sample.person("unit")
 
-        self.sample.todo("unit", status="closed")
+        # Named apart, as the same name for the same person in the same second is rejected
+
+        self.sample.todo("unit", "closed", status="closed")
         self.sample.todo("test")
 
         self.assertFalse(service.ToDo.todos({
@@ -3214,7 +3834,9 @@ class TestToDo(TestRest):
         self.assertFalse(service.ToDo.complete(todo))
         mock_notify.assert_called_once()
 
-        todo = self.sample.todo("unit", "hey", data={
+        # A second later, as another "hey" now would be rejected
+
+        todo = self.sample.todo("unit", "hey", created=8, data={
             "text": "you",
             "area": area.id,
             "act": True,
@@ -3511,6 +4133,20 @@ class TestToDoCL(TestRest):
 
         todo_id = response.json["todo"]["id"]
 
+        # The same name for the same person in the same second is already there
+
+        response = self.api.post("/todo", json={
+            "todo": {
+                "person_id": person.id,
+                "name": "unit",
+                "status": "opened"
+            }
+        })
+
+        self.assertEqual(response.status_code, 409, response.json)
+        self.assertTrue(response.json["message"].startswith("already exists: "), response.json)
+        self.assertEqual([todo.id for todo in self.session.query(mysql.ToDo).all()], [todo_id])
+
     @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
     def test_get(self):
 
@@ -4106,8 +4742,10 @@ class TestRoutine(TestRest):
 
         person = self.sample.person("unit")
 
+        # Named apart, as the same name for the same person in the same second is rejected
+
         todo = self.sample.todo("unit")
-        self.sample.todo("unit", status="closed")
+        self.sample.todo("unit", "closed", status="closed")
         self.sample.todo("test")
 
         # explicit 
@@ -4740,6 +5378,26 @@ class TestRoutineCL(TestRest):
             }
         })
 
+        # Reminding and expiring, due the later of the interval and the delay
+
+        response = self.api.post("/routine", json={
+            "routine": {
+                "person_id": person.id,
+                "name": "timed",
+                "data": {
+                    "text": "hey",
+                    "interval": 5,
+                    "delay": 10,
+                    "expires": 50
+                }
+            }
+        })
+
+        self.assertStatusModel(response, 201, "routine", {
+            "name": "timed",
+            "due": 17
+        })
+
     @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
     def test_get(self):
 
@@ -5010,6 +5668,23 @@ class TestRoutineRUD(TestRest):
             "status": "closed"
         })
 
+        self.assertStatusValue(self.api.patch(f"/routine/{routine.id}", json={
+            "routine": {
+                "status": "opened",
+                "yaml": "start: 1\nexpires: 5\n"
+            }
+        }), 202, "updated", 1)
+
+        self.assertStatusModel(self.api.get(f"/routine/{routine.id}"), 200, "routine", {
+            "due": 6
+        })
+
+        self.assertStatusValue(self.api.patch("/routine/0", json={
+            "routine": {
+                "status": "closed"
+            }
+        }), 202, "updated", 0)
+
     def test_delete(self):
 
         routine = self.sample.routine("test", "unit")
@@ -5018,6 +5693,66 @@ class TestRoutineRUD(TestRest):
 
         self.assertStatusModels(self.api.get("/routine"), 200, "routines", [])
 
+class TestRoutineDue(TestRest):
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_get(self):
+
+        self.sample.routine("unit", "expired", data={
+            "start": 1,
+            "expires": 5
+        })
+        self.sample.routine("unit", "reminded", data={
+            "start": 1,
+            "notified": 1,
+            "tasks": [
+                {
+                    "start": 1,
+                    "interval": 4,
+                    "notified": 2
+                }
+            ]
+        })
+        self.sample.routine("unit", "later", data={
+            "start": 1,
+            "interval": 8,
+            "notified": 1
+        })
+        self.sample.routine("unit", "closed", status="closed", data={
+            "start": 1,
+            "expires": 1
+        })
+        self.sample.routine("unit", "never")
+
+        response = self.api.get("/routine/due")
+
+        self.assertStatusModels(response, 200, "routines", [
+            {
+                "name": "expired",
+                "due": 6
+            },
+            {
+                "name": "reminded",
+                "due": 6
+            }
+        ])
+        self.assertEqual(len(response.json["routines"]), 2)
+        self.assertEqual(response.json["next"], 9)
+
+        response = self.api.get("/routine/due?at=9")
+
+        self.assertEqual([routine["name"] for routine in response.json["routines"]], ["expired", "reminded", "later"])
+        self.assertIsNone(response.json["next"])
+
+        response = self.api.get("/routine/due?fields=status,data")
+
+        self.assertEqual([sorted(routine.keys()) for routine in response.json["routines"]], [["data", "id", "status"], ["data", "id", "status"]])
+        self.assertEqual(response.json["routines"][0]["data"]["expires"], 5)
+
+        response = self.api.get("/routine/due?fields=status&expand=person")
+
+        self.assertEqual([routine["person"]["name"] for routine in response.json["routines"]], ["unit", "unit"])
+
 class TestRoutineA(TestRest):
 
     @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
@@ -5045,6 +5780,16 @@ class TestRoutineA(TestRest):
         self.session.commit()
         self.assertEqual(item.data["notified"], 7)
 
+        # remind, only if not notified since
+
+        with unittest.mock.patch("service.notify") as mock_notify:
+
+            self.assertStatusValue(self.api.patch(f"/routine/{routine.id}/remind", json={"notified": 6}), 202, "updated", False)
+            mock_notify.assert_not_called()
+
+            self.assertStatusValue(self.api.patch(f"/routine/{routine.id}/remind", json={"notified": 7}), 202, "updated", True)
+            mock_notify.assert_called_once()
+
         # next
 
         self.assertStatusValue(self.api.patch(f"/routine/{routine.id}/next"), 202, "updated", True)
@@ -5341,6 +6086,16 @@ class TestTaskA(TestRest):
         self.session.commit()
         self.assertEqual(item.data["tasks"][0]["notified"], 7)
 
+        # remind, only if not notified since
+
+        with unittest.mock.patch("service.notify") as mock_notify:
+
+            self.assertStatusValue(self.api.patch(f"/routine/{routine.id}/task/0/remind", json={"notified": 6}), 202, "updated", False)
+            mock_notify.assert_not_called()
+
+            self.assertStatusValue(self.api.patch(f"/routine/{routine.id}/task/0/remind", json={"notified": 7}), 202, "updated", True)
+            mock_notify.assert_called_once()
+
         # pause
 
         self.assertStatusValue(self.api.patch(f"/routine/{routine.id}/task/0/pause"), 202, "updated", True)
@@ -5388,3 +6143,191 @@ class TestTaskA(TestRest):
         self.session.commit()
         self.assertEqual(item.status, "opened")
         self.assertStatusValue(self.api.patch(f"/routine/{routine.id}/task/0/uncomplete"), 202, "updated", False)
+
+class TestBatch(TestRest):
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    @unittest.mock.patch("service.notify", unittest.mock.MagicMock)
+    def test_patch(self):
+
+        routine = self.sample.routine("unit", "hey", data={
+            "text": "hey",
+            "tasks": [
+                {
+                    "text": "do it",
+                    "start": 0
+                }
+            ]
+        })
+
+        todo = self.sample.todo("unit", "hey")
+
+        response = self.api.patch("/batch", json={
+            "actions": [
+                {
+                    "kind": "routine",
+                    "id": routine.id,
+                    "action": "remind"
+                },
+                {
+                    "kind": "routine",
+                    "id": routine.id,
+                    "action": "remind",
+                    "notified": 6
+                },
+                {
+                    "kind": "task",
+                    "id": routine.id,
+                    "task_id": 0,
+                    "action": "remind",
+                    "notified": 6
+                },
+                {
+                    "kind": "task",
+                    "id": routine.id,
+                    "task_id": 0,
+                    "action": "pause"
+                },
+                {
+                    "kind": "task",
+                    "id": routine.id,
+                    "task_id": 1,
+                    "action": "pause"
+                },
+                {
+                    "kind": "todo",
+                    "id": todo.id,
+                    "action": "expire"
+                },
+                {
+                    "kind": "todo",
+                    "id": todo.id,
+                    "action": "expire"
+                },
+                {
+                    "kind": "todo",
+                    "id": todo.id,
+                    "action": "nope"
+                },
+                {
+                    "kind": "nope",
+                    "id": todo.id,
+                    "action": "remind"
+                }
+            ]
+        })
+
+        self.assertStatusValue(response, 202, "results", [
+            {"updated": True},
+            {"updated": False},
+            {"updated": False},
+            {"updated": True},
+            {"message": "list index out of range"},
+            {"updated": True},
+            {"updated": False},
+            {"message": "unknown action todo nope"},
+            {"message": "unknown action nope remind"}
+        ])
+
+        item = self.session.query(mysql.Routine).get(routine.id)
+        self.session.commit()
+        self.assertEqual(item.data["notified"], 7)
+        self.assertTrue(item.data["tasks"][0]["paused"])
+
+        item = self.session.query(mysql.ToDo).get(todo.id)
+        self.session.commit()
+        self.assertEqual(item.status, "closed")
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    @unittest.mock.patch("service.notify", unittest.mock.MagicMock)
+    def test_patch_creating(self):
+
+        routine = self.sample.routine("unit", "hey", data={
+            "text": "hey"
+        })
+
+        todo = self.sample.todo("unit", "hey", data={
+            "text": "you",
+            "act": True
+        })
+
+        # Completing the todo creates an act, which mustn't end the batch
+
+        response = self.api.patch("/batch", json={
+            "actions": [
+                {
+                    "kind": "routine",
+                    "id": routine.id,
+                    "action": "remind"
+                },
+                {
+                    "kind": "todo",
+                    "id": todo.id,
+                    "action": "complete"
+                },
+                {
+                    "kind": "routine",
+                    "id": routine.id,
+                    "action": "pause"
+                }
+            ]
+        })
+
+        self.assertStatusValue(response, 202, "results", [
+            {"updated": True},
+            {"updated": True},
+            {"updated": True}
+        ])
+
+        item = self.session.query(mysql.Routine).get(routine.id)
+        self.session.commit()
+        self.assertEqual(item.data["notified"], 7)
+        self.assertTrue(item.data["paused"])
+
+        item = self.session.query(mysql.ToDo).get(todo.id)
+        self.session.commit()
+        self.assertEqual(item.status, "closed")
+
+        self.assertEqual(self.session.query(mysql.Act).filter_by(name="hey").one().data["text"], "you")
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    @unittest.mock.patch("service.notify", unittest.mock.MagicMock)
+    def test_patch_conflict(self):
+
+        area = self.sample.area("unit", "hey", status="positive", data={
+            "todo": {
+                "name": "fix",
+                "text": "it"
+            }
+        })
+
+        # Wronging again in the same second would make the same ToDo again
+
+        response = self.api.patch("/batch", json={
+            "actions": [
+                {
+                    "kind": "area",
+                    "id": area.id,
+                    "action": "wrong"
+                },
+                {
+                    "kind": "area",
+                    "id": area.id,
+                    "action": "right"
+                },
+                {
+                    "kind": "area",
+                    "id": area.id,
+                    "action": "wrong"
+                }
+            ]
+        })
+
+        self.assertEqual(response.status_code, 202, response.json)
+        self.assertEqual(response.json["results"][:2], [{"updated": True}, {"updated": True}])
+        self.assertTrue(response.json["results"][2]["message"].startswith("already exists: "), response.json)
+
+        item = self.session.query(mysql.Area).get(area.id)
+        self.session.commit()
+        self.assertEqual(item.status, "positive")
+        self.assertEqual(self.session.query(mysql.ToDo).filter_by(name="fix").count(), 1)
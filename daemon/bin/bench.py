@@ -0,0 +1,5 @@
+#!/usr/bin/env python
+
+import benchmark
+
+benchmark.main()
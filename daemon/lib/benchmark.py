@@ -0,0 +1,327 @@
+"""
+Benchmark for the daemon, running it against a stub of the chore API
+serving synthetic routines and measuring how late reminders go out
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+import http.server
+import socketserver
+import urllib.parse
+
+import service
+
+ROUTINES = 1000
+SECONDS = 60
+
+
+def generate(count, now=None, seed=None):
+    """
+    Generates synthetic routines with a mix of delays, intervals, expirations and pauses
+    """
+
+    now = time.time() if now is None else now
+    generator = random.Random(seed)
+
+    routines = []
+
+    for id in range(1, count + 1):
+
+        # Start from a steady state, where nothing is overdue yet
+
+        start = now - generator.uniform(0, 300)
+
+        data = {
+            "text": f"routine {id}",
+            "start": start
+        }
+
+        if generator.random() < 0.3:
+            data["delay"] = generator.uniform(0, 300)
+
+        if generator.random() < 0.8:
+            data["interval"] = generator.uniform(5, 120)
+            data["notified"] = now - generator.uniform(0, data["interval"])
+
+        if generator.random() < 0.2:
+            data["expires"] = generator.uniform(300, 3600)
+
+        if generator.random() < 0.1:
+            data["paused"] = True
+
+        if generator.random() < 0.3:
+            interval = generator.uniform(5, 60)
+            data["tasks"] = [
+                {
+                    "id": 0,
+                    "text": "first",
+                    "start": start,
+                    "notified": now - generator.uniform(0, interval),
+                    "interval": interval
+                },
+                {
+                    "id": 1,
+                    "text": "second"
+                }
+            ]
+
+        routines.append({
+            "id": id,
+            "name": f"routine {id}",
+            "status": "opened",
+            "created": int(start),
+            "updated": int(start),
+            "data": data
+        })
+
+    return routines
+
+
+def percentile(values, percent):
+    """
+    Gets a percentile from a list of values, nearest rank
+    """
+
+    if not values:
+        return None
+
+    ordered = sorted(values)
+
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class Stub(object):
+    """
+    Stands in for the chore API, serving routines and recording what the daemon does
+    """
+
+    def __init__(self, routines):
+
+        self.routines = {routine["id"]: routine for routine in routines}
+        self.lock = threading.Lock()
+
+        self.calls = {}
+        self.lateness = {
+            "remind": [],
+            "expire": []
+        }
+
+        self.started = time.time()
+
+    def record(self, call):
+
+        self.calls[call] = self.calls.get(call, 0) + 1
+
+    def get(self, path, query):
+        """
+        Lists, retrieves or finds due routines
+        """
+
+        now = time.time()
+
+        with self.lock:
+
+            if path == "/routine":
+
+                if "since" in query:
+                    self.record("GET /routine?since")
+                    after = now - float(query["since"]) * 60*60*24
+                    routines = [routine for routine in self.routines.values() if routine["updated"] > after]
+                else:
+                    self.record("GET /routine")
+                    routines = [routine for routine in self.routines.values() if routine["status"] == query.get("status", routine["status"])]
+
+                return {"routines": routines}
+
+            if path == "/routine/due":
+
+                self.record("GET /routine/due")
+
+                at = float(query.get("at", now))
+                due = [(self.due(routine), routine) for routine in self.routines.values() if routine["status"] == "opened"]
+
+                return {
+                    "routines": [routine for (deadline, routine) in due if deadline is not None and deadline <= at],
+                    "next": min([deadline for (deadline, routine) in due if deadline is not None and deadline > at], default=None)
+                }
+
+            self.record("GET /routine/<id>")
+
+            return {"routine": self.routines[int(path.split("/")[2])]}
+
+    @staticmethod
+    def due(routine):
+        """
+        When a routine or its current task is next due
+        """
+
+        deadlines = [service.Daemon.deadline(routine["data"])]
+
+        for task in routine["data"].get("tasks", []):
+            if "start" in task and "end" not in task:
+                deadlines.append(service.Daemon.deadline(task, expire=False))
+                break
+
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+
+        return min(deadlines) if deadlines else None
+
+    def act(self, id, action, task_id=None, notified=None):
+        """
+        Applies a remind or expire, recording how late it was, unless notified since the daemon saw it
+        """
+
+        now = time.time()
+        routine = self.routines[id]
+
+        if task_id is None:
+            data = routine["data"]
+        else:
+            data = routine["data"]["tasks"][task_id]
+
+        if notified is not None and data.get("notified") != notified:
+            self.record("stale")
+            return False
+
+        if action == "expire":
+            self.lateness["expire"].append(now - (data["start"] + data["expires"]))
+            routine["status"] = "closed"
+        else:
+            self.lateness["remind"].append(now - service.Daemon.deadline(data, expire=False))
+            data["notified"] = now
+
+        routine["updated"] = int(now)
+
+        return True
+
+    def patch(self, path, body):
+        """
+        Handles routine, task and batch actions
+        """
+
+        with self.lock:
+
+            if path == "/batch":
+
+                self.record("PATCH /batch")
+
+                return {"results": [
+                    {"updated": self.act(operation["id"], operation["action"], operation.get("task_id"), operation.get("notified"))}
+                    for operation in body["actions"]
+                ]}
+
+            match = re.match(r"^/routine/(\d+)/task/(\d+)/(\w+)$", path)
+
+            if match:
+                self.record(f"PATCH /routine/<id>/task/<id>/{match.group(3)}")
+                return {"updated": self.act(int(match.group(1)), match.group(3), int(match.group(2)), (body or {}).get("notified"))}
+
+            match = re.match(r"^/routine/(\d+)/(\w+)$", path)
+
+            self.record(f"PATCH /routine/<id>/{match.group(2)}")
+
+            return {"updated": self.act(int(match.group(1)), match.group(2), None, (body or {}).get("notified"))}
+
+    def serve(self, port=0):
+        """
+        Serves the stub on a port in the background, returning the server
+        """
+
+        stub = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def respond(self, body):
+
+                content = json.dumps(body).encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+
+                url = urllib.parse.urlparse(self.path)
+                self.respond(stub.get(url.path, dict(urllib.parse.parse_qsl(url.query))))
+
+            def do_PATCH(self):
+
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+
+                self.respond(stub.patch(urllib.parse.urlparse(self.path).path, body))
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        server = Server(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return server
+
+    def report(self):
+        """
+        Summarizes lateness percentiles and API calls per minute
+        """
+
+        minutes = (time.time() - self.started) / 60
+
+        with self.lock:
+
+            report = {
+                "minutes": minutes,
+                "calls": {call: count / minutes for (call, count) in sorted(self.calls.items())},
+                "total": sum(self.calls.values()) / minutes
+            }
+
+            for (action, lateness) in self.lateness.items():
+                report[action] = {
+                    "count": len(lateness),
+                    "p50": percentile(lateness, 50),
+                    "p90": percentile(lateness, 90),
+                    "p99": percentile(lateness, 99),
+                    "max": max(lateness) if lateness else None
+                }
+
+        return report
+
+
+def main(args=None):
+    """
+    Runs the daemon, configured as usual through its environment, against
+    the stub for a while and prints the report
+    """
+
+    parser = argparse.ArgumentParser(description="Benchmarks the chore daemon against a stub API")
+    parser.add_argument("--routines", type=int, default=ROUTINES, help="number of synthetic routines")
+    parser.add_argument("--seconds", type=float, default=SECONDS, help="how long to run the daemon")
+    parser.add_argument("--seed", type=int, default=None, help="random seed for the routines")
+    options = parser.parse_args(args)
+
+    stub = Stub(generate(options.routines, seed=options.seed))
+    server = stub.serve()
+
+    service.os.environ["CHORE_API"] = f"http://127.0.0.1:{server.server_address[1]}"
+
+    threading.Thread(target=service.Daemon().run, daemon=True).start()
+
+    time.sleep(options.seconds)
+
+    report = stub.report()
+    server.shutdown()
+    server.server_close()
+
+    print(json.dumps(report, indent=4))
+
+    return report
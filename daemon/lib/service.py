@@ -3,9 +3,77 @@ Main module for daemon
 """
 
 import os
+import json
+import math
 import time
+import uuid
+import heapq
+import codecs
+import threading
+import collections
 import requests
+import requests.adapters
 import traceback
+import concurrent.futures
+
+import redis
+import pymysql
+import prometheus_client
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+POOL = 10
+TIMEOUT = 10.0
+WORKERS = 1
+RESYNC = 300.0
+SOURCE = "routines"
+BATCH = "false"
+PARTITIONS = 1
+LEASE = 30
+VECTORIZE = "true"
+CHUNK = 16384
+SLOW = 1.0
+LATE = 1.0
+DATABASE = "nandy"
+
+PASSES = prometheus_client.Histogram(
+    "chore_daemon_pass_seconds", "Time taken by each pass over all routines"
+)
+EVALUATED = prometheus_client.Counter(
+    "chore_daemon_evaluated_total", "Routines and tasks evaluated", ["kind"]
+)
+ACTIONS = prometheus_client.Counter(
+    "chore_daemon_actions_total", "Actions sent to the API", ["kind", "action"]
+)
+FAILURES = prometheus_client.Counter(
+    "chore_daemon_failures_total", "Failures by where they happened", ["stage"]
+)
+POLL = prometheus_client.Gauge(
+    "chore_daemon_poll_seconds", "Current time between passes over all routines"
+)
+LATENESS = prometheus_client.Histogram(
+    "chore_daemon_lateness_seconds", "Time between an action coming due and being dispatched", ["action"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, float("inf"))
+)
+
+# Only touch a lease if it's still ours
+
+RENEW = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
 
 class Daemon(object):
     """
@@ -16,15 +84,113 @@ class Daemon(object):
 
         self.sleep = float(os.environ['SLEEP'])
 
+        # How often to poll starts at sleep, adapting between the bounds (just sleep if not set)
+        # to how soon things are due, how late they've been, and how the API's holding up
+
+        self.interval = self.sleep
+        self.bounds = (
+            float(os.environ.get("MIN_SLEEP", self.sleep)),
+            float(os.environ.get("MAX_SLEEP", self.sleep))
+        )
+        self.slow = float(os.environ.get("SLOW", SLOW))
+        self.tardy = float(os.environ.get("LATE", LATE))
+        self.late = 0.0
+        self.failed = False
+        self.latency = 0.0
+
         self.chore = os.environ['CHORE_API']
 
+        # More than one worker processes routines in parallel, each routine's calls in order on one worker
+
+        self.workers = int(os.environ.get("WORKERS", WORKERS))
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+
+        # One long lived session so connections to the API are kept alive and reused
+
+        pool = int(os.environ.get("POOL", max(POOL, self.workers)))
+
+        self.session = requests.Session()
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool))
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=pool, pool_maxsize=pool))
+
+        self.timeout = float(os.environ.get("TIMEOUT", TIMEOUT))
+
+        self.deadlines = []
+        self.scheduled = {}
+        self.lock = threading.Lock()
+
+        # Routines are cached by id, refreshed with what's changed and fully every resync to catch deletes
+
+        self.routines = {}
+        self.synced = None
+        self.resynced = None
+        self.resync = float(os.environ.get("RESYNC", RESYNC))
+
+        # The due source only fetches what the API says comes due before the next sync,
+        # while the stream source processes routines as they come in without caching
+
+        self.source = os.environ.get("SOURCE", SOURCE)
+
+        # The mysql source reads routines straight from the database (or a replica of it),
+        # still sending every action through the API
+
+        if self.source == "mysql":
+            self.mysql = pymysql.connect(
+                host=os.environ['MYSQL_HOST'],
+                port=int(os.environ['MYSQL_PORT']),
+                user='root',
+                database=os.environ.get("DATABASE", DATABASE),
+                autocommit=True
+            )
+        else:
+            self.mysql = None
+
+        # Batching queues up all of a pass's actions to send in one request
+
+        self.batch = os.environ.get("BATCH", BATCH).lower() == "true"
+        self.actions = []
+
+        # Routines whose cached copy can't be trusted, as when a remind we
+        # mirrored locally didn't take, so need getting again before checking
+
+        self.stale = set()
+
+        # With Redis, the cache is kept current from the API's notifications instead of polling
+
+        if "REDIS_HOST" in os.environ:
+            self.redis = redis.StrictRedis(host=os.environ['REDIS_HOST'], port=int(os.environ['REDIS_PORT']))
+            self.channel = os.environ['REDIS_CHANNEL']
+        else:
+            self.redis = None
+
+        self.wake = threading.Event()
+
+        # With more than one partition, routines are split up by id among however
+        # many daemons there are, each leasing its share of partitions from Redis
+
+        self.partitions = int(os.environ.get("PARTITIONS", PARTITIONS))
+        self.lease = int(os.environ.get("LEASE", LEASE))
+
+        if self.partitions > 1 and self.redis is None:
+            raise ValueError("PARTITIONS needs REDIS_HOST to lease partitions from")
+        self.identity = uuid.uuid4().hex
+        self.owned = set() if self.partitions > 1 else None
+
+        # Port to serve Prometheus metrics on, if any
+
+        self.metrics = int(os.environ.get("METRICS", 0))
+
+        # With numpy around, whole passes are evaluated at once rather than routine by routine
+
+        self.vectorize = numpy is not None and os.environ.get("VECTORIZE", VECTORIZE).lower() == "true"
+
     @staticmethod
-    def expire(data):
+    def expire(data, now=None):
         """
         Determines if there's a need to expire
         """
 
-        now = time.time()
+        now = time.time() if now is None else now
 
         # If it has an expires and it's been more than that much time
 
@@ -34,12 +200,12 @@ class Daemon(object):
         return False
 
     @staticmethod
-    def remind(data):
+    def remind(data, now=None):
         """
         Determines if there's a need to remind
         """
 
-        now = time.time()
+        now = time.time() if now is None else now
 
         # If it has a delay and isn't time yet, don't bother yet
 
@@ -58,54 +224,802 @@ class Daemon(object):
 
         return False
 
-    def tasks(self, routine):
+    @staticmethod
+    def lateness(data, action, now=None):
+        """
+        Determines how long ago an action came due
+        """
+
+        now = time.time() if now is None else now
+
+        if action == "expire":
+            return now - (data["start"] + data["expires"])
+
+        return now - Daemon.deadline(data, expire=False)
+
+    @staticmethod
+    def deadline(data, expire=True):
+        """
+        Determines when there'll next be a need to expire or remind
+        """
+
+        deadlines = []
+
+        # If it expires, that's when
+
+        if expire and "expires" in data:
+            deadlines.append(data["start"] + data["expires"])
+
+        # If it has an interval and isn't paused, it's the later of the delay and the interval
+
+        if "interval" in data and not data.get("paused"):
+
+            deadline = data["notified"] + data["interval"]
+
+            if "delay" in data:
+                deadline = max(deadline, data["start"] + data["delay"])
+
+            deadlines.append(deadline)
+
+        return min(deadlines) if deadlines else None
+
+    def observe(self, action, lateness):
+        """
+        Records how late an action was
+        """
+
+        LATENESS.labels(action).observe(lateness)
+
+        with self.lock:
+            self.late = max(self.late, lateness)
+
+    def fail(self, stage):
+        """
+        Records a failure
+        """
+
+        FAILURES.labels(stage).inc()
+        self.failed = True
+
+    def adapt(self):
+        """
+        Polls more often when things are coming due or running late, less often
+        when nothing's due for a while or the API's slow or failing
+        """
+
+        (least, most) = self.bounds
+
+        with self.lock:
+            (late, failed, self.late, self.failed) = (self.late, self.failed, 0.0, False)
+            upcoming = min(self.scheduled.values(), default=None)
+
+        ahead = None if upcoming is None else upcoming - time.time()
+
+        if failed or self.latency > self.slow:
+            interval = self.interval * 2
+        elif late > self.tardy or (ahead is not None and ahead < self.interval):
+            interval = self.interval / 2
+        elif ahead is None or ahead > most:
+            interval = self.interval * 2
+        else:
+            interval = self.interval
+
+        self.interval = min(most, max(least, interval))
+        POLL.set(self.interval)
+
+    def schedule(self, routine, now=None):
+        """
+        Schedules the next time a routine needs to be checked
+        """
+
+        deadlines = [self.deadline(routine["data"])]
+
+        for task in routine["data"].get("tasks", []):
+
+            if "start" in task and "end" not in task:
+                deadlines.append(self.deadline(task, expire=False))
+                break
+
+        # Anything not in the future has already been acted on
+
+        now = time.time() if now is None else now
+        deadlines = [deadline for deadline in deadlines if deadline is not None and deadline > now]
+
+        if deadlines:
+            self.push(min(deadlines), routine["id"])
+
+    def push(self, deadline, id):
+        """
+        Sets when a routine needs to be checked next, replacing whatever was before
+        """
+
+        with self.lock:
+            self.scheduled[id] = deadline
+            heapq.heappush(self.deadlines, (deadline, id))
+
+    def due(self):
+        """
+        Pops the id of a routine whose deadline has come up, else returns None
+        with when the next deadline is, skipping any that have been replaced
+        """
+
+        with self.lock:
+
+            while self.deadlines:
+
+                (deadline, id) = self.deadlines[0]
+
+                if self.scheduled.get(id) != deadline:
+                    heapq.heappop(self.deadlines)
+                    continue
+
+                if deadline > time.time():
+                    return (None, deadline)
+
+                heapq.heappop(self.deadlines)
+                del self.scheduled[id]
+
+                return (id, deadline)
+
+        return (None, None)
+
+    def mine(self, id):
+        """
+        Determines if a routine is in one of our partitions
+        """
+
+        return self.owned is None or id % self.partitions in self.owned
+
+    def claim(self):
+        """
+        Heartbeats our membership and leases, giving up or taking partitions
+        so every live daemon has its fair share
+        """
+
+        prefix = f"{self.channel}/daemon"
+
+        # Members are scored by when they last heartbeat, so those that haven't
+        # within a lease drop out without having to scan for them
+
+        now = time.time()
+
+        self.redis.zadd(f"{prefix}/members", now, self.identity)
+        self.redis.zremrangebyscore(f"{prefix}/members", "-inf", now - self.lease)
+
+        share = int(math.ceil(self.partitions / max(1, self.redis.zcard(f"{prefix}/members"))))
+
+        owned = set()
+
+        for partition in sorted(self.owned):
+            if self.redis.eval(RENEW, 1, f"{prefix}/partition/{partition}", self.identity, self.lease):
+                owned.add(partition)
+
+        while len(owned) > share:
+            partition = max(owned)
+            self.redis.eval(RELEASE, 1, f"{prefix}/partition/{partition}", self.identity)
+            owned.remove(partition)
+
+        for partition in range(self.partitions):
+
+            if len(owned) >= share:
+                break
+
+            if partition not in owned and self.redis.set(f"{prefix}/partition/{partition}", self.identity, ex=self.lease, nx=True):
+                owned.add(partition)
+
+        # If what's ours changed, go through everything again
+
+        if owned != self.owned:
+            self.owned = owned
+            self.resynced = None
+            self.wake.set()
+
+    def heartbeat(self):
+        """
+        Keeps our leases current, giving up everything if we can't
+        """
+
+        while True:
+
+            try:
+                self.claim()
+            except Exception as exception:
+                self.owned = set()
+                print(str(exception))
+                print(traceback.format_exc())
+
+            time.sleep(self.lease / 3)
+
+    def act(self, routine, action, task=None):
+        """
+        Sends an action for a routine or one of its tasks, or queues it if batching
+        """
+
+        ACTIONS.labels("routine" if task is None else "task", action).inc()
+
+        # Reminds say when what we saw was last notified, so the API can drop
+        # them if someone else beat us to it
+
+        data = routine["data"] if task is None else task
+        precondition = {"notified": data["notified"]} if action == "remind" and "notified" in data else {}
+
+        if self.batch:
+
+            if task is None:
+                operation = {"kind": "routine", "id": routine["id"], "action": action, **precondition}
+            else:
+                operation = {"kind": "task", "id": routine["id"], "task_id": task["id"], "action": action, **precondition}
+
+            with self.lock:
+                self.actions.append(operation)
+
+            return
+
+        if task is None:
+            url = f"{self.chore}/routine/{routine['id']}/{action}"
+        else:
+            url = f"{self.chore}/routine/{routine['id']}/task/{task['id']}/{action}"
+
+        response = self.session.patch(url, json=precondition, timeout=self.timeout)
+        response.raise_for_status()
+
+        if action == "remind" and response.json().get("updated") is not True:
+            with self.lock:
+                self.stale.add(routine["id"])
+
+    def flush(self):
+        """
+        Sends all the queued actions in one batch, logging any that failed
+        """
+
+        with self.lock:
+            (actions, self.actions) = (self.actions, [])
+
+        if not actions:
+            return
+
+        # Reminds were mirrored locally when queued, so any that didn't take
+        # leave a cached copy the API never stored
+
+        try:
+            response = self.session.patch(f"{self.chore}/batch", json={"actions": actions}, timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()["results"]
+        except Exception:
+            with self.lock:
+                self.stale.update(action["id"] for action in actions if action["action"] == "remind")
+            raise
+
+        for (action, result) in zip(actions, results):
+
+            if "message" in result:
+                self.fail("action")
+                print(f"{action}: {result['message']}")
+
+            if action["action"] == "remind" and result.get("updated") is not True:
+                with self.lock:
+                    self.stale.add(action["id"])
+
+    def tasks(self, routine, now=None):
         """
         Sees if any reminders need to go out for a task of a routine
         """
 
+        now = time.time() if now is None else now
+
         for task in routine["data"]["tasks"]:
 
             if "start" in task and "end" not in task:
-                
-                if self.remind(task):
 
-                    requests.patch(f"{self.chore}/routine/{routine['id']}/task/{task['id']}/remind").raise_for_status()
+                EVALUATED.labels("task").inc()
+
+                if self.remind(task, now):
+
+                    self.observe("remind", self.lateness(task, "remind", now))
+                    self.act(routine, "remind", task)
+
+                    # Mirror what the API just did so we don't reschedule what we just sent
+
+                    task["notified"] = now
+                    routine["data"]["notified"] = task["notified"]
 
                 break
 
-    def routine(self, routine):
+    def routine(self, routine, now=None):
         """
         Sees if any reminders need to go out for a routine
         """
 
-        if self.expire(routine["data"]):
-            requests.patch(f"{self.chore}/routine/{routine['id']}/expire").raise_for_status()
+        now = time.time() if now is None else now
+
+        EVALUATED.labels("routine").inc()
+
+        if self.expire(routine["data"], now):
+            self.observe("expire", self.lateness(routine["data"], "expire", now))
+            self.act(routine, "expire")
             return
 
-        if self.remind(routine["data"]):
-            requests.patch(f"{self.chore}/routine/{routine['id']}/remind").raise_for_status()
+        if self.remind(routine["data"], now):
+            self.observe("remind", self.lateness(routine["data"], "remind", now))
+            self.act(routine, "remind")
+            routine["data"]["notified"] = now
 
         if "tasks" in routine["data"]:
-            self.tasks(routine)
+            self.tasks(routine, now)
+
+        self.schedule(routine, now)
+
+    def evaluate(self, routines, now):
+        """
+        Evaluates routines and their current tasks all at once, scheduling
+        those with nothing to do and returning those that need acting on
+        """
+
+        # A row for each routine and its current task, if any
 
+        (owners, rows, tasks) = ([], [], [])
+
+        for (index, routine) in enumerate(routines):
+
+            owners.append(index)
+            rows.append(routine["data"])
+            tasks.append(False)
+
+            for task in routine["data"].get("tasks", []):
+
+                if "start" in task and "end" not in task:
+                    owners.append(index)
+                    rows.append(task)
+                    tasks.append(True)
+                    break
+
+        owners = numpy.array(owners, dtype=int)
+        tasks = numpy.array(tasks, dtype=bool)
+
+        # Whatever's missing is NaN, which never compares as due
+
+        nan = numpy.nan
+
+        (start, delay, interval, notified, expires, paused) = numpy.array([
+            (
+                row.get("start", nan), row.get("delay", nan), row.get("interval", nan),
+                row.get("notified", nan), row.get("expires", nan), bool(row.get("paused"))
+            )
+            for row in rows
+        ], dtype=float).reshape(-1, 6).T
+
+        paused = paused.astype(bool)
+        expires[tasks] = nan
+
+        with numpy.errstate(invalid="ignore"):
+
+            expire = expires + start < now
+            remind = ~(delay + start > now) & ~paused & (now > notified + interval)
+
+            reminding = ~numpy.isnan(interval) & ~paused
+            deadline = numpy.fmin(
+                start + expires,
+                numpy.where(reminding, numpy.fmax(notified + interval, start + delay), numpy.nan)
+            )
+            deadline[~(deadline > now)] = numpy.nan
+
+        # Roll rows up to their routines
+
+        act = numpy.zeros(len(routines), dtype=bool)
+        numpy.logical_or.at(act, owners, expire | remind)
+
+        upcoming = numpy.full(len(routines), numpy.nan)
+        numpy.fmin.at(upcoming, owners, deadline)
+
+        EVALUATED.labels("routine").inc(int((~act).sum()))
+        EVALUATED.labels("task").inc(int((~act[owners[tasks]]).sum()))
+
+        idle = numpy.flatnonzero(~act & ~numpy.isnan(upcoming))
+
+        with self.lock:
+
+            for (index, deadline) in zip(idle.tolist(), upcoming[idle].tolist()):
+                self.scheduled[routines[index]["id"]] = deadline
+                self.deadlines.append((deadline, routines[index]["id"]))
+
+            heapq.heapify(self.deadlines)
+
+        return [routines[index] for index in numpy.flatnonzero(act).tolist()]
+
+    def dispatch(self, routine, now=None):
+        """
+        Processes a single routine, logging rather than raising any errors
+        """
+
+        try:
+            self.routine(routine, now)
+        except Exception as exception:
+            self.fail("routine")
+            print(str(exception))
+            print(traceback.format_exc())
+
+    def select(self, where, *values):
+        """
+        Reads routines from the database, just what's needed to evaluate them
+        """
+
+        self.mysql.ping(reconnect=True)
+
+        with self.mysql.cursor() as cursor:
+            cursor.execute(f"SELECT id, status, data FROM routine WHERE {where}", values)
+            rows = cursor.fetchall()
+
+        return [{"id": id, "status": status, "data": json.loads(data)} for (id, status, data) in rows]
+
+    def get(self, path):
+        """
+        Gets from the API, raising if it didn't work out
+        """
+
+        response = self.session.get(f"{self.chore}{path}", timeout=self.timeout)
+        response.raise_for_status()
+
+        return response.json()
+
+    def sync(self):
+        """
+        Updates the routine cache, with just what comes due before the next sync
+        from the due source, else only what's changed since the last sync unless
+        it's time for a full resync
+        """
+
+        now = time.time()
+
+        if self.source == "due":
+
+            at = now + (self.resync if self.redis else self.interval)
+
+            routines = self.get(f"/routine/due?at={at}&fields=id,status,data")["routines"]
+
+            with self.lock:
+                self.routines = {routine["id"]: routine for routine in routines}
+                self.stale = set()
+
+            self.resynced = now
+
+        elif self.resynced is None or now - self.resynced > self.resync:
+
+            if self.mysql:
+                routines = self.select("status = 'opened'")
+            else:
+                routines = self.get("/routine?status=opened&fields=id,status,data")["routines"]
+
+            with self.lock:
+                self.routines = {routine["id"]: routine for routine in routines}
+                self.stale = set()
+
+            self.resynced = now
+
+        elif not self.redis:
+
+            # since is in days and updated is whole seconds, so pad a bit to not miss anything
+
+            if self.mysql:
+                routines = self.select("updated >= %s", int(self.synced) - 2)
+            else:
+                since = (now - self.synced + 2) / (60*60*24)
+                routines = self.get(f"/routine?since={since}&fields=id,status,data")["routines"]
+
+            with self.lock:
+                for routine in routines:
+                    self.stale.discard(routine["id"])
+                    if routine["status"] == "opened":
+                        self.routines[routine["id"]] = routine
+                    else:
+                        self.routines.pop(routine["id"], None)
+
+        self.synced = now
+
+    @staticmethod
+    def parse(chunks):
+        """
+        Yields each routine from a routine list body as soon as it's come in whole
+        """
+
+        decoder = json.JSONDecoder()
+        text = codecs.getincrementaldecoder("utf-8")()
+        chunks = iter(chunks)
+
+        def more():
+
+            chunk = next(chunks, None)
+
+            if chunk is None:
+                raise ValueError("routine list ended early")
+
+            return text.decode(chunk)
+
+        # Skip to the start of the list
+
+        buffer = ""
+
+        while "[" not in buffer:
+            buffer += more()
+
+        buffer = buffer[buffer.index("[") + 1:]
+
+        while True:
+
+            buffer = buffer.lstrip(" \t\r\n,")
+
+            if not buffer:
+                buffer = more()
+                continue
+
+            if buffer[0] == "]":
+                return
+
+            try:
+                (routine, end) = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                buffer += more()
+                continue
+
+            buffer = buffer[end:]
+
+            # Nothing here needs the yaml, so don't keep it around
+
+            routine.pop("yaml", None)
+
+            yield routine
+
+    def stream(self, now):
+        """
+        Processes opened routines one at a time as they come in, never holding
+        more than a few at once
+        """
+
+        # Even if this fails, wait till the next pass rather than retrying right away
+
+        self.resynced = now
+
+        pending = collections.deque()
+
+        response = self.session.get(f"{self.chore}/routine?status=opened&fields=id,status,data", stream=True, timeout=self.timeout)
+
+        try:
+
+            response.raise_for_status()
+
+            self.latency = response.elapsed.total_seconds()
+
+            for routine in self.parse(response.iter_content(CHUNK)):
+
+                if not self.mine(routine["id"]):
+                    continue
+
+                if self.pool:
+
+                    pending.append(self.pool.submit(self.dispatch, routine, now))
+
+                    if len(pending) > self.workers * 2:
+                        pending.popleft().result()
+
+                else:
+
+                    self.dispatch(routine, now)
+
+        finally:
+
+            response.close()
+
+            for future in pending:
+                future.result()
+
+    @PASSES.time()
     def process(self):
         """
         Processes all the routines for reminding
         """
 
-        for routine in requests.get(f"{self.chore}/routine?status=opened").json()["routines"]:
+        with self.lock:
+            self.deadlines = []
+            self.scheduled = {}
+
+        if self.source == "stream":
 
             try:
+                self.stream(time.time())
+            except Exception as exception:
+                self.fail("stream")
+                print(str(exception))
+                print(traceback.format_exc())
+
+        else:
+
+            # If the API's down or erroring, work from what's cached and back off
+
+            try:
+                started = time.time()
+                self.sync()
+                self.latency = time.time() - started
+            except Exception as exception:
+                self.fail("sync")
+                print(str(exception))
+                print(traceback.format_exc())
+
+            with self.lock:
+                routines = [routine for routine in self.routines.values() if self.mine(routine["id"])]
+                stale = [routine["id"] for routine in routines if routine["id"] in self.stale]
+
+            # Every decision in a pass is made as of the same moment
+
+            now = time.time()
+
+            # What's stale gets checked afresh instead
+
+            if stale:
+                routines = [routine for routine in routines if routine["id"] not in stale]
+
+                for id in stale:
+                    self.push(now, id)
+
+            if self.vectorize:
+                routines = self.evaluate(routines, now)
+
+            if self.pool:
+                list(self.pool.map(self.dispatch, routines, [now] * len(routines)))
+            else:
+                for routine in routines:
+                    self.dispatch(routine, now)
+
+        try:
+            self.flush()
+        except Exception as exception:
+            self.fail("batch")
+            print(str(exception))
+            print(traceback.format_exc())
+
+        self.adapt()
+
+    def check(self, id):
+        """
+        Rechecks a single routine whose deadline has come up
+        """
+
+        if not self.mine(id):
+            return
+
+        try:
+
+            # Notifications keep the cache current, unless it's stale, else go get the latest
+
+            with self.lock:
+                stale = id in self.stale
+
+            if self.redis and self.source != "stream" and not stale:
+                with self.lock:
+                    routine = self.routines.get(id)
+            elif self.mysql:
+                routine = next(iter(self.select("id = %s", id)), None)
+            else:
+                routine = self.get(f"/routine/{id}?fields=id,status,data")["routine"]
+
+            with self.lock:
+                self.stale.discard(id)
+
+            if routine is None:
+                with self.lock:
+                    self.routines.pop(id, None)
+                return
+
+            if routine["status"] == "opened":
+                if self.source != "stream":
+                    with self.lock:
+                        self.routines[id] = routine
                 self.routine(routine)
+                self.flush()
+            else:
+                with self.lock:
+                    self.routines.pop(id, None)
+
+        except Exception as exception:
+            self.fail("check")
+            print(str(exception))
+            print(traceback.format_exc())
+
+    def receive(self, message):
+        """
+        Updates the cache from a routine or task notification, and has the routine checked
+        """
+
+        if message.get("kind") not in ["routine", "task"]:
+            return
+
+        routine = message["routine"]
+
+        if self.source != "stream":
+            with self.lock:
+                self.stale.discard(routine["id"])
+                if routine["status"] == "opened":
+                    self.routines[routine["id"]] = routine
+                else:
+                    self.routines.pop(routine["id"], None)
+
+        if routine["status"] == "opened" and self.mine(routine["id"]):
+            self.push(time.time(), routine["id"])
+
+        self.wake.set()
+
+    def subscribe(self):
+        """
+        Listens for notifications, resyncing fully whenever (re)subscribed in
+        case anything was missed
+        """
+
+        while True:
+
+            try:
+
+                pubsub = self.redis.pubsub()
+                pubsub.subscribe(self.channel)
+
+                self.resynced = None
+                self.wake.set()
+
+                for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.receive(json.loads(message["data"]))
+
             except Exception as exception:
                 print(str(exception))
                 print(traceback.format_exc())
 
+            time.sleep(self.sleep)
+
+    def wait(self, until):
+        """
+        Sleeps until a point in time, if it's in the future, or a notification wakes us
+        """
+
+        delay = until - time.time()
+
+        if delay > 0:
+
+            if self.redis:
+                self.wake.wait(delay)
+                self.wake.clear()
+            else:
+                time.sleep(delay)
+
     def run(self):
         """
-        Runs the daemon
+        Runs the daemon, refreshing all routines every sleep (resync if notified)
+        and checking individual routines exactly as their deadlines come up in between
         """
 
+        if self.metrics:
+            prometheus_client.start_http_server(self.metrics)
+
+        if self.redis:
+            threading.Thread(target=self.subscribe, daemon=True).start()
+
+        if self.owned is not None:
+            threading.Thread(target=self.heartbeat, daemon=True).start()
+
         while True:
+
             self.process()
-            time.sleep(self.sleep)
+
+            # Without a full sync yet there's nothing to check, so wait out the
+            # backed off interval rather than trying again right away
+
+            if self.resynced is None:
+                self.wait(time.time() + self.interval)
+                continue
+
+            refresh = time.time() + (self.resync if self.redis else self.interval)
+
+            while time.time() < refresh and self.resynced is not None:
+
+                (id, deadline) = self.due()
+
+                if id is not None:
+                    self.check(id)
+                else:
+                    self.wait(min(deadline, refresh) if deadline is not None else refresh)
@@ -0,0 +1,228 @@
+import unittest
+import unittest.mock
+
+import os
+import requests
+
+import benchmark
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_generate(self):
+
+        routines = benchmark.generate(200, now=1000.0, seed=7)
+
+        self.assertEqual(len(routines), 200)
+        self.assertEqual(routines, benchmark.generate(200, now=1000.0, seed=7))
+
+        self.assertEqual(routines[0]["id"], 1)
+        self.assertEqual(routines[0]["status"], "opened")
+        self.assertLessEqual(routines[0]["data"]["start"], 1000.0)
+
+        for setting in ["delay", "interval", "expires", "paused", "tasks"]:
+            self.assertTrue(any(setting in routine["data"] for routine in routines))
+            self.assertFalse(all(setting in routine["data"] for routine in routines))
+
+    def test_percentile(self):
+
+        self.assertIsNone(benchmark.percentile([], 50))
+        self.assertEqual(benchmark.percentile([3, 1, 2, 4], 50), 3)
+        self.assertEqual(benchmark.percentile([3, 1, 2, 4], 100), 4)
+        self.assertEqual(benchmark.percentile([3, 1, 2, 4], 0), 1)
+
+
+class TestStub(unittest.TestCase):
+
+    def setUp(self):
+
+        self.stub = benchmark.Stub([
+            {
+                "id": 1,
+                "status": "opened",
+                "updated": 0,
+                "data": {
+                    "start": 0,
+                    "notified": 0,
+                    "interval": 5,
+                    "expires": 100
+                }
+            },
+            {
+                "id": 2,
+                "status": "opened",
+                "updated": 0,
+                "data": {
+                    "start": 0,
+                    "tasks": [
+                        {
+                            "id": 0,
+                            "start": 0,
+                            "notified": 0,
+                            "interval": 3
+                        }
+                    ]
+                }
+            },
+            {
+                "id": 3,
+                "status": "closed",
+                "updated": 0,
+                "data": {}
+            }
+        ])
+
+    @unittest.mock.patch("benchmark.time.time")
+    def test_get(self, mock_time):
+
+        mock_time.return_value = 4
+
+        self.assertEqual([routine["id"] for routine in self.stub.get("/routine", {"status": "opened"})["routines"]], [1, 2])
+        self.assertEqual([routine["id"] for routine in self.stub.get("/routine", {})["routines"]], [1, 2, 3])
+
+        self.stub.routines[3]["updated"] = 3
+        self.assertEqual([routine["id"] for routine in self.stub.get("/routine", {"since": str(2/86400)})["routines"]], [3])
+
+        self.assertEqual(self.stub.get("/routine/due", {}), {
+            "routines": [self.stub.routines[2]],
+            "next": 5
+        })
+
+        self.assertEqual(self.stub.get("/routine/1", {}), {"routine": self.stub.routines[1]})
+
+        self.assertEqual(self.stub.calls, {
+            "GET /routine": 2,
+            "GET /routine?since": 1,
+            "GET /routine/due": 1,
+            "GET /routine/<id>": 1
+        })
+
+    def test_due(self):
+
+        self.assertEqual(self.stub.due(self.stub.routines[1]), 5)
+        self.assertEqual(self.stub.due(self.stub.routines[2]), 3)
+        self.assertIsNone(self.stub.due(self.stub.routines[3]))
+
+    @unittest.mock.patch("benchmark.time.time")
+    def test_act(self, mock_time):
+
+        mock_time.return_value = 7
+
+        self.assertTrue(self.stub.act(1, "remind"))
+        self.assertEqual(self.stub.routines[1]["data"]["notified"], 7)
+        self.assertEqual(self.stub.routines[1]["updated"], 7)
+
+        self.assertTrue(self.stub.act(2, "remind", 0))
+        self.assertEqual(self.stub.routines[2]["data"]["tasks"][0]["notified"], 7)
+        self.assertNotIn("notified", self.stub.routines[2]["data"])
+
+        self.assertFalse(self.stub.act(1, "remind", None, 6))
+        self.assertEqual(self.stub.calls, {"stale": 1})
+
+        mock_time.return_value = 101
+
+        self.assertTrue(self.stub.act(1, "expire"))
+        self.assertEqual(self.stub.routines[1]["status"], "closed")
+
+        self.assertEqual(self.stub.lateness, {
+            "remind": [2, 4],
+            "expire": [1]
+        })
+
+    @unittest.mock.patch("benchmark.time.time")
+    def test_patch(self, mock_time):
+
+        mock_time.return_value = 7
+
+        self.assertEqual(self.stub.patch("/routine/1/remind", None), {"updated": True})
+        self.assertEqual(self.stub.patch("/routine/2/task/0/remind", None), {"updated": True})
+        self.assertEqual(self.stub.patch("/batch", {"actions": [
+            {"kind": "routine", "id": 1, "action": "remind"},
+            {"kind": "task", "id": 2, "task_id": 0, "action": "remind"}
+        ]}), {"results": [{"updated": True}, {"updated": True}]})
+
+        self.assertEqual(self.stub.calls, {
+            "PATCH /routine/<id>/remind": 1,
+            "PATCH /routine/<id>/task/<id>/remind": 1,
+            "PATCH /batch": 1
+        })
+        self.assertEqual(len(self.stub.lateness["remind"]), 4)
+
+    def test_serve(self):
+
+        server = self.stub.serve()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        try:
+
+            response = requests.get(f"{url}/routine/3")
+            response.raise_for_status()
+            self.assertEqual(response.json(), {"routine": self.stub.routines[3]})
+
+            response = requests.patch(f"{url}/batch", json={"actions": [{"kind": "routine", "id": 1, "action": "remind"}]})
+            response.raise_for_status()
+            self.assertEqual(response.json(), {"results": [{"updated": True}]})
+
+        finally:
+
+            server.shutdown()
+            server.server_close()
+
+    @unittest.mock.patch("benchmark.time.time")
+    def test_report(self, mock_time):
+
+        mock_time.return_value = 0
+        self.stub.started = 0
+
+        self.stub.calls = {"GET /routine": 4, "PATCH /batch": 2}
+        self.stub.lateness["remind"] = [0.5, 0.1, 0.3, 0.2]
+
+        mock_time.return_value = 120
+
+        self.assertEqual(self.stub.report(), {
+            "minutes": 2,
+            "calls": {
+                "GET /routine": 2,
+                "PATCH /batch": 1
+            },
+            "total": 3,
+            "remind": {
+                "count": 4,
+                "p50": 0.3,
+                "p90": 0.5,
+                "p99": 0.5,
+                "max": 0.5
+            },
+            "expire": {
+                "count": 0,
+                "p50": None,
+                "p90": None,
+                "p99": None,
+                "max": None
+            }
+        })
+
+
+class TestMain(unittest.TestCase):
+
+    @unittest.mock.patch.dict(os.environ, {"SLEEP": "0.1"})
+    @unittest.mock.patch("benchmark.time.sleep")
+    @unittest.mock.patch("benchmark.threading.Thread")
+    @unittest.mock.patch("benchmark.service.Daemon")
+    @unittest.mock.patch("builtins.print")
+    def test_main(self, mock_print, mock_daemon, mock_thread, mock_sleep):
+
+        mock_server = unittest.mock.MagicMock()
+        mock_server.server_address = ("127.0.0.1", 1234)
+
+        with unittest.mock.patch("benchmark.Stub.serve", return_value=mock_server):
+            report = benchmark.main(["--routines", "10", "--seconds", "3", "--seed", "1"])
+
+        self.assertEqual(os.environ["CHORE_API"], "http://127.0.0.1:1234")
+        mock_thread.assert_called_once_with(target=mock_daemon.return_value.run, daemon=True)
+        mock_thread.return_value.start.assert_called_once_with()
+        mock_sleep.assert_called_once_with(3)
+        mock_server.shutdown.assert_called_once_with()
+
+        self.assertEqual(report["remind"]["count"], 0)
+        mock_print.assert_called_once()
@@ -4,19 +4,111 @@ import unittest.mock
 import os
 import json
 
+import redis
+import requests
+import prometheus_client
+
 import service
 
 
+class MockPubSub(object):
+
+    def __init__(self, messages):
+
+        self.messages = messages
+        self.channel = None
+
+    def subscribe(self, channel):
+
+        self.channel = channel
+
+    def listen(self):
+
+        for message in self.messages:
+
+            if isinstance(message, Exception):
+                raise message
+
+            yield message
+
+
+class MockRedis(object):
+
+    def __init__(self, host, port):
+
+        self.host = host
+        self.port = port
+
+        self.pubsubs = []
+        self.data = {}
+        self.expires = {}
+
+    def pubsub(self):
+
+        return self.pubsubs.pop(0)
+
+    def set(self, name, value, ex=None, nx=False):
+
+        if nx and name in self.data:
+            return None
+
+        self.data[name] = str(value)
+        self.expires[name] = ex
+
+        return True
+
+    def zadd(self, name, *args, **kwargs):
+
+        if len(args) % 2 != 0:
+            raise redis.exceptions.RedisError("ZADD requires an equal number of values and scores")
+
+        members = self.data.setdefault(name, {})
+
+        for (score, member) in zip(args[::2], args[1::2]):
+            members[member] = score
+
+        members.update(kwargs)
+
+    def zremrangebyscore(self, name, least, most):
+
+        least = float(least)
+
+        for (member, score) in list(self.data.get(name, {}).items()):
+            if least <= score <= most:
+                del self.data[name][member]
+
+    def zcard(self, name):
+
+        return len(self.data.get(name, {}))
+
+    def eval(self, script, numkeys, key, *args):
+
+        if self.data.get(key) != args[0]:
+            return 0
+
+        if script == service.RENEW:
+            self.expires[key] = args[1]
+        elif script == service.RELEASE:
+            del self.data[key]
+
+        return 1
+
+
 class TestService(unittest.TestCase):
 
     @unittest.mock.patch.dict(os.environ, {
         "CHORE_API": "http://toast.com",
         "SLEEP": "0.7"
     })
+    @unittest.mock.patch("requests.Session", unittest.mock.MagicMock)
     def setUp(self):
 
         self.daemon = service.Daemon()
 
+    def sample(self, name, **labels):
+
+        return prometheus_client.REGISTRY.get_sample_value(name, labels) or 0
+
     @unittest.mock.patch.dict(os.environ, {
         "CHORE_API": "http://toast.com",
         "SLEEP": "0.7"
@@ -27,6 +119,154 @@ class TestService(unittest.TestCase):
 
         self.assertEqual(daemon.chore, "http://toast.com")
         self.assertEqual(daemon.sleep, 0.7)
+        self.assertEqual(daemon.interval, 0.7)
+        self.assertEqual(daemon.bounds, (0.7, 0.7))
+        self.assertEqual(daemon.slow, 1.0)
+        self.assertEqual(daemon.tardy, 1.0)
+        self.assertEqual(daemon.late, 0.0)
+        self.assertFalse(daemon.failed)
+        self.assertEqual(daemon.deadlines, [])
+        self.assertEqual(daemon.scheduled, {})
+        self.assertEqual(daemon.timeout, 10.0)
+        self.assertEqual(daemon.session.get_adapter("http://toast.com")._pool_maxsize, 10)
+        self.assertEqual(daemon.workers, 1)
+        self.assertIsNone(daemon.pool)
+        self.assertEqual(daemon.routines, {})
+        self.assertIsNone(daemon.synced)
+        self.assertIsNone(daemon.resynced)
+        self.assertEqual(daemon.resync, 300.0)
+        self.assertEqual(daemon.source, "routines")
+        self.assertIsNone(daemon.mysql)
+        self.assertFalse(daemon.batch)
+        self.assertEqual(daemon.actions, [])
+        self.assertEqual(daemon.partitions, 1)
+        self.assertEqual(daemon.lease, 30)
+        self.assertIsNone(daemon.owned)
+        self.assertEqual(daemon.metrics, 0)
+        self.assertIsNone(daemon.redis)
+        self.assertFalse(daemon.wake.is_set())
+        self.assertEqual(daemon.vectorize, service.numpy is not None)
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "0.7",
+        "VECTORIZE": "false"
+    })
+    def test___init___vectorize(self):
+
+        self.assertFalse(service.Daemon().vectorize)
+
+        with unittest.mock.patch("service.numpy", None):
+            os.environ["VECTORIZE"] = "true"
+            self.assertFalse(service.Daemon().vectorize)
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "5",
+        "MIN_SLEEP": "1",
+        "MAX_SLEEP": "60",
+        "SLOW": "2.5",
+        "LATE": "3"
+    })
+    def test___init___sleep(self):
+
+        daemon = service.Daemon()
+
+        self.assertEqual(daemon.interval, 5)
+        self.assertEqual(daemon.bounds, (1, 60))
+        self.assertEqual(daemon.slow, 2.5)
+        self.assertEqual(daemon.tardy, 3)
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "0.7",
+        "POOL": "3",
+        "TIMEOUT": "1.5"
+    })
+    def test___init___pool(self):
+
+        daemon = service.Daemon()
+
+        self.assertEqual(daemon.timeout, 1.5)
+        self.assertEqual(daemon.session.get_adapter("http://toast.com")._pool_maxsize, 3)
+        self.assertEqual(daemon.session.get_adapter("https://toast.com")._pool_connections, 3)
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "0.7",
+        "WORKERS": "20"
+    })
+    def test___init___workers(self):
+
+        daemon = service.Daemon()
+
+        self.assertEqual(daemon.workers, 20)
+        self.assertEqual(daemon.pool._max_workers, 20)
+        self.assertEqual(daemon.session.get_adapter("http://toast.com")._pool_maxsize, 20)
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "0.7",
+        "REDIS_HOST": "most.com",
+        "REDIS_PORT": "667",
+        "REDIS_CHANNEL": "stuff"
+    })
+    @unittest.mock.patch("redis.StrictRedis", MockRedis)
+    def test___init___redis(self):
+
+        daemon = service.Daemon()
+
+        self.assertEqual(daemon.redis.host, "most.com")
+        self.assertEqual(daemon.redis.port, 667)
+        self.assertEqual(daemon.channel, "stuff")
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "0.7",
+        "SOURCE": "mysql",
+        "MYSQL_HOST": "replica.com",
+        "MYSQL_PORT": "3307"
+    })
+    @unittest.mock.patch("pymysql.connect")
+    def test___init___mysql(self, mock_connect):
+
+        daemon = service.Daemon()
+
+        self.assertEqual(daemon.mysql, mock_connect.return_value)
+        mock_connect.assert_called_once_with(
+            host="replica.com",
+            port=3307,
+            user="root",
+            database="nandy",
+            autocommit=True
+        )
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "0.7",
+        "REDIS_HOST": "most.com",
+        "REDIS_PORT": "667",
+        "REDIS_CHANNEL": "stuff",
+        "PARTITIONS": "4",
+        "LEASE": "9"
+    })
+    @unittest.mock.patch("redis.StrictRedis", MockRedis)
+    def test___init___partitions(self):
+
+        daemon = service.Daemon()
+
+        self.assertEqual(daemon.partitions, 4)
+        self.assertEqual(daemon.lease, 9)
+        self.assertEqual(daemon.owned, set())
+        self.assertEqual(len(daemon.identity), 32)
+
+        # Without Redis there's nowhere to lease from
+
+        with unittest.mock.patch.dict(os.environ):
+
+            del os.environ["REDIS_HOST"]
+
+            self.assertRaisesRegex(ValueError, "PARTITIONS needs REDIS_HOST", service.Daemon)
 
     @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
     def test_expire(self):
@@ -41,6 +281,11 @@ class TestService(unittest.TestCase):
             "start": 1
         }))
 
+        self.assertTrue(self.daemon.expire({
+            "expires": 6,
+            "start": 1
+        }, 8))
+
     @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
     def test_remind(self):
 
@@ -71,139 +316,1449 @@ class TestService(unittest.TestCase):
             "notified": 5
         }))
 
+        self.assertTrue(self.daemon.remind({
+            "delay": 6,
+            "start": 1,
+            "paused": False,
+            "interval": 2,
+            "notified": 5
+        }, 8))
+
     @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
-    @unittest.mock.patch("requests.patch")
-    def test_tasks(self, mock_patch):
+    def test_lateness(self):
 
-        routine = {
-            "id": 1,
-            "data": {
-                "text": "hey",
-                "language": "cursing",
-                "tasks": [
-                    {
-                        "id": 0,
-                        "start": 0,
-                        "delay": 6,
-                        "start": 1,
-                        "paused": False,
-                        "interval": 2,
-                        "notified": 4
-                    }
-                ]
-            }
-        }
+        self.assertEqual(self.daemon.lateness({
+            "start": 1,
+            "expires": 5
+        }, "expire"), 1)
 
-        self.daemon.tasks(routine)
-        mock_patch.assert_has_calls([
-            unittest.mock.call("http://toast.com/routine/1/task/0/remind"),
-            unittest.mock.call().raise_for_status()
-        ])
+        self.assertEqual(self.daemon.lateness({
+            "start": 1,
+            "delay": 4,
+            "interval": 1,
+            "notified": 1
+        }, "remind"), 2)
 
-        routine["data"]["tasks"][0]["notified"] = 7
-        self.daemon.tasks(routine)
-        mock_patch.assert_called_once()
+        self.assertEqual(self.daemon.lateness({
+            "start": 1,
+            "expires": 5
+        }, "expire", 9), 3)
 
-        routine["data"]["tasks"][0]["notified"] = 4
-        routine["data"]["tasks"][0]["end"] = 0
-        self.daemon.tasks(routine)
-        mock_patch.assert_called_once()
+    def test_deadline(self):
 
-    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
-    @unittest.mock.patch("requests.patch")
-    def test_routine(self, mock_patch):
+        self.assertIsNone(self.daemon.deadline({
+            "start": 1
+        }))
 
-        routine =  {
-            "id": 1,
-            "data": {
-                "start": 0,
-                "expires": 6
-            }
-        }
+        self.assertEqual(self.daemon.deadline({
+            "start": 1,
+            "expires": 5
+        }), 6)
 
-        self.daemon.routine(routine)
+        self.assertIsNone(self.daemon.deadline({
+            "start": 1,
+            "expires": 5
+        }, expire=False))
 
-        mock_patch.assert_has_calls([
-            unittest.mock.call("http://toast.com/routine/1/expire"),
-            unittest.mock.call().raise_for_status(),
-        ])
+        self.assertEqual(self.daemon.deadline({
+            "start": 1,
+            "interval": 2,
+            "notified": 4
+        }), 6)
 
-        routine =  {
+        self.assertEqual(self.daemon.deadline({
+            "start": 1,
+            "delay": 7,
+            "interval": 2,
+            "notified": 4
+        }), 8)
+
+        self.assertIsNone(self.daemon.deadline({
+            "start": 1,
+            "interval": 2,
+            "notified": 4,
+            "paused": True
+        }))
+
+        self.assertEqual(self.daemon.deadline({
+            "start": 1,
+            "expires": 4,
+            "interval": 2,
+            "notified": 4
+        }), 5)
+
+    def test_observe(self):
+
+        late = self.sample("chore_daemon_lateness_seconds_sum", action="remind")
+
+        self.daemon.observe("remind", 2)
+        self.daemon.observe("remind", 1)
+
+        self.assertEqual(self.sample("chore_daemon_lateness_seconds_sum", action="remind"), late + 3)
+        self.assertEqual(self.daemon.late, 2)
+
+    def test_fail(self):
+
+        failures = self.sample("chore_daemon_failures_total", stage="check")
+
+        self.daemon.fail("check")
+
+        self.assertEqual(self.sample("chore_daemon_failures_total", stage="check"), failures + 1)
+        self.assertTrue(self.daemon.failed)
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=100))
+    def test_adapt(self):
+
+        self.daemon.interval = 8
+        self.daemon.bounds = (1, 30)
+
+        # Nothing coming up, back off
+
+        self.daemon.adapt()
+        self.assertEqual(self.daemon.interval, 16)
+        self.assertEqual(self.sample("chore_daemon_poll_seconds"), 16)
+
+        # Something's due soon, speed up
+
+        self.daemon.scheduled = {1: 110, 2: 120}
+        self.daemon.adapt()
+        self.assertEqual(self.daemon.interval, 8)
+
+        # Comfortably ahead, stay put
+
+        self.daemon.adapt()
+        self.assertEqual(self.daemon.interval, 8)
+
+        # Running late, speed up, though not past the bound
+
+        for interval in [4, 2, 1, 1]:
+            self.daemon.late = 1.5
+            self.daemon.adapt()
+            self.assertEqual(self.daemon.interval, interval)
+            self.assertEqual(self.daemon.late, 0.0)
+
+        # Failing or slow, back off even if late, though not past the bound
+
+        self.daemon.late = 1.5
+        self.daemon.failed = True
+        self.daemon.adapt()
+        self.assertEqual(self.daemon.interval, 2)
+        self.assertFalse(self.daemon.failed)
+
+        self.daemon.latency = 1.5
+
+        for interval in [4, 8, 16, 30, 30]:
+            self.daemon.adapt()
+            self.assertEqual(self.daemon.interval, interval)
+
+        # Far off, back off
+
+        self.daemon.latency = 0
+        self.daemon.interval = 8
+        self.daemon.scheduled = {1: 200}
+        self.daemon.adapt()
+        self.assertEqual(self.daemon.interval, 16)
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_schedule(self):
+
+        self.daemon.schedule({
             "id": 1,
             "data": {
-                "start": 0,
-                "delay": 6,
                 "start": 1,
-                "paused": False,
                 "interval": 2,
-                "notified": 4,
-                "text": "hey",
-                "language": "cursing",
+                "notified": 6,
                 "tasks": [
                     {
-                        "id": 0,
-                        "start": 0,
-                        "delay": 6,
                         "start": 1,
-                        "paused": False,
-                        "interval": 2,
-                        "notified": 4
+                        "end": 2,
+                        "interval": 1,
+                        "notified": 6
+                    },
+                    {
+                        "start": 2,
+                        "interval": 3,
+                        "notified": 6
                     }
                 ]
             }
-        }
+        })
 
-        mock_patch.reset_mock()
+        self.daemon.schedule({
+            "id": 2,
+            "data": {
+                "start": 1,
+                "expires": 10,
+                "tasks": [
+                    {
+                        "start": 2,
+                        "interval": 1,
+                        "notified": 7
+                    }
+                ]
+            }
+        })
 
-        self.daemon.routine(routine)
+        self.daemon.schedule({
+            "id": 3,
+            "data": {
+                "start": 1,
+                "interval": 2,
+                "notified": 4
+            }
+        })
 
-        mock_patch.assert_has_calls([
-            unittest.mock.call("http://toast.com/routine/1/remind"),
-            unittest.mock.call().raise_for_status(),
-            unittest.mock.call("http://toast.com/routine/1/task/0/remind"),
-            unittest.mock.call().raise_for_status()
-        ])
+        self.assertEqual(self.daemon.deadlines, [(8, 1), (8, 2)])
+        self.assertEqual(self.daemon.scheduled, {1: 8, 2: 8})
 
-        routine["data"]["notified"] = 7
-        routine["data"]["tasks"][0]["notified"] = 7
+    def test_push(self):
 
-        self.daemon.routine(routine)
-        self.assertEqual(mock_patch.call_count, 2)
+        self.daemon.push(8, 1)
+        self.daemon.push(6, 2)
+        self.daemon.push(7, 1)
 
-    @unittest.mock.patch("requests.get")
-    @unittest.mock.patch("service.Daemon.routine")
-    @unittest.mock.patch("traceback.format_exc")
-    @unittest.mock.patch('builtins.print')
-    def test_process(self, mock_print, mock_traceback, mock_routine, mock_get):
+        self.assertEqual(self.daemon.deadlines, [(6, 2), (8, 1), (7, 1)])
+        self.assertEqual(self.daemon.scheduled, {1: 7, 2: 6})
 
-        mock_get.return_value.json.return_value = {
-            "routines": ["hey"]
-        }
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_due(self):
 
-        mock_routine.side_effect= [Exception("whoops")]
-        mock_traceback.return_value = "spirograph"
+        self.assertEqual(self.daemon.due(), (None, None))
 
-        self.daemon.process()
+        self.daemon.push(5, 1)
+        self.daemon.push(6, 2)
+        self.daemon.push(8, 1)
+        self.daemon.push(9, 3)
 
-        mock_get.assert_called_with("http://toast.com/routine?status=opened")
+        self.assertEqual(self.daemon.due(), (2, 6))
+        self.assertEqual(self.daemon.due(), (None, 8))
+        self.assertEqual(self.daemon.scheduled, {1: 8, 3: 9})
+        self.assertEqual(self.daemon.deadlines, [(8, 1), (9, 3)])
 
-        mock_routine.assert_called_once_with("hey")
+    def test_mine(self):
 
-        mock_print.assert_has_calls([
-            unittest.mock.call("whoops"),
-            unittest.mock.call("spirograph")
-        ])
+        self.assertTrue(self.daemon.mine(3))
 
-    @unittest.mock.patch("requests.get")
-    @unittest.mock.patch("service.time.sleep")
-    def test_run(self, mock_sleep, mock_get):
+        self.daemon.partitions = 4
+        self.daemon.owned = {1, 2}
 
-        mock_get.return_value.json.return_value = {
-            "routines": []
-        }
+        self.assertFalse(self.daemon.mine(3))
+        self.assertTrue(self.daemon.mine(6))
 
-        mock_sleep.side_effect = [Exception("adaisy")]
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_claim(self):
 
-        self.assertRaisesRegex(Exception, "adaisy", self.daemon.run)
+        self.daemon.redis = MockRedis("most.com", 667)
+        self.daemon.channel = "stuff"
+        self.daemon.partitions = 4
+        self.daemon.lease = 9
+        self.daemon.identity = "me"
+        self.daemon.owned = set()
+        self.daemon.resynced = 7
+
+        # Alone, takes everything
+
+        self.daemon.claim()
+
+        self.assertEqual(self.daemon.owned, {0, 1, 2, 3})
+        self.assertEqual(self.daemon.redis.data, {
+            "stuff/daemon/members": {"me": 7},
+            "stuff/daemon/partition/0": "me",
+            "stuff/daemon/partition/1": "me",
+            "stuff/daemon/partition/2": "me",
+            "stuff/daemon/partition/3": "me"
+        })
+        self.assertIsNone(self.daemon.resynced)
+        self.assertTrue(self.daemon.wake.is_set())
+
+        # Nothing changes, just renews
+
+        self.daemon.resynced = 7
+        self.daemon.wake.clear()
+        self.daemon.redis.expires["stuff/daemon/partition/0"] = 1
+
+        self.daemon.claim()
+
+        self.assertEqual(self.daemon.owned, {0, 1, 2, 3})
+        self.assertEqual(self.daemon.redis.expires["stuff/daemon/partition/0"], 9)
+        self.assertEqual(self.daemon.resynced, 7)
+        self.assertFalse(self.daemon.wake.is_set())
+
+        # Someone joins, gives up half
+
+        self.daemon.redis.zadd("stuff/daemon/members", 5, "you")
+
+        self.daemon.claim()
+
+        self.assertEqual(self.daemon.owned, {0, 1})
+        self.assertNotIn("stuff/daemon/partition/2", self.daemon.redis.data)
+        self.assertNotIn("stuff/daemon/partition/3", self.daemon.redis.data)
+
+        # They take theirs and then a lease of ours gets lost
+
+        self.daemon.redis.set("stuff/daemon/partition/2", "you")
+        self.daemon.redis.set("stuff/daemon/partition/3", "you")
+        self.daemon.redis.data["stuff/daemon/partition/1"] = "you"
+
+        self.daemon.claim()
+
+        self.assertEqual(self.daemon.owned, {0})
+
+        # They go quiet for a lease, so their leases lapse and we take it all back
+
+        service.time.time.return_value = 17
+
+        for partition in [1, 2, 3]:
+            del self.daemon.redis.data[f"stuff/daemon/partition/{partition}"]
+
+        self.daemon.claim()
+
+        self.assertEqual(self.daemon.redis.data["stuff/daemon/members"], {"me": 17})
+        self.assertEqual(self.daemon.owned, {0, 1, 2, 3})
+
+    @unittest.mock.patch("service.time.sleep")
+    @unittest.mock.patch("traceback.format_exc")
+    @unittest.mock.patch('builtins.print')
+    @unittest.mock.patch("service.Daemon.claim")
+    def test_heartbeat(self, mock_claim, mock_print, mock_traceback, mock_sleep):
+
+        self.daemon.lease = 9
+        self.daemon.owned = {1}
+
+        mock_claim.side_effect = [None, Exception("whoops")]
+        mock_traceback.return_value = "spirograph"
+        mock_sleep.side_effect = [None, Exception("adaisy")]
+
+        self.assertRaisesRegex(Exception, "adaisy", self.daemon.heartbeat)
+
+        self.assertEqual(self.daemon.owned, set())
+        mock_print.assert_has_calls([
+            unittest.mock.call("whoops"),
+            unittest.mock.call("spirograph")
+        ])
+        mock_sleep.assert_called_with(3)
+
+    def test_act(self):
+
+        mock_patch = self.daemon.session.patch
+        mock_patch.return_value.json.return_value = {"updated": True}
+
+        self.daemon.act({"id": 1, "data": {"notified": 3}}, "expire")
+        self.daemon.act({"id": 1, "data": {"notified": 3}}, "remind")
+        self.daemon.act({"id": 1, "data": {}}, "remind", {"id": 2, "notified": 4})
+        self.daemon.act({"id": 1, "data": {}}, "remind", {"id": 3})
+
+        mock_patch.assert_has_calls([
+            unittest.mock.call("http://toast.com/routine/1/expire", json={}, timeout=10.0),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call("http://toast.com/routine/1/remind", json={"notified": 3}, timeout=10.0),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call().json(),
+            unittest.mock.call("http://toast.com/routine/1/task/2/remind", json={"notified": 4}, timeout=10.0),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call().json(),
+            unittest.mock.call("http://toast.com/routine/1/task/3/remind", json={}, timeout=10.0),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call().json()
+        ])
+        self.assertEqual(self.daemon.stale, set())
+
+        # A remind that didn't take leaves what's cached stale
+
+        mock_patch.return_value.json.return_value = {"updated": False}
+
+        self.daemon.act({"id": 1, "data": {"notified": 3}}, "remind")
+
+        self.assertEqual(self.daemon.stale, {1})
+
+        mock_patch.reset_mock()
+        self.daemon.batch = True
+
+        self.daemon.act({"id": 1, "data": {"notified": 3}}, "expire")
+        self.daemon.act({"id": 1, "data": {}}, "remind", {"id": 2, "notified": 4})
+
+        mock_patch.assert_not_called()
+        self.assertEqual(self.daemon.actions, [
+            {
+                "kind": "routine",
+                "id": 1,
+                "action": "expire"
+            },
+            {
+                "kind": "task",
+                "id": 1,
+                "task_id": 2,
+                "action": "remind",
+                "notified": 4
+            }
+        ])
+
+    @unittest.mock.patch('builtins.print')
+    def test_flush(self, mock_print):
+
+        mock_patch = self.daemon.session.patch
+        failures = self.sample("chore_daemon_failures_total", stage="action")
+
+        self.daemon.flush()
+        mock_patch.assert_not_called()
+
+        self.daemon.actions = [
+            {
+                "kind": "routine",
+                "id": 1,
+                "action": "expire"
+            },
+            {
+                "kind": "routine",
+                "id": 2,
+                "action": "remind"
+            }
+        ]
+
+        mock_patch.return_value.json.return_value = {
+            "results": [
+                {"updated": True},
+                {"message": "whoops"}
+            ]
+        }
+
+        self.daemon.flush()
+
+        mock_patch.assert_called_once_with("http://toast.com/batch", json={"actions": [
+            {
+                "kind": "routine",
+                "id": 1,
+                "action": "expire"
+            },
+            {
+                "kind": "routine",
+                "id": 2,
+                "action": "remind"
+            }
+        ]}, timeout=10.0)
+        mock_patch.return_value.raise_for_status.assert_called_once_with()
+
+        self.assertEqual(self.daemon.actions, [])
+        mock_print.assert_called_once_with("{'kind': 'routine', 'id': 2, 'action': 'remind'}: whoops")
+        self.assertEqual(self.sample("chore_daemon_failures_total", stage="action"), failures + 1)
+
+        # Reminds that failed or didn't take leave what's cached stale
+
+        self.assertEqual(self.daemon.stale, {2})
+
+        self.daemon.stale = set()
+        self.daemon.actions = [
+            {"kind": "routine", "id": 1, "action": "remind"},
+            {"kind": "routine", "id": 2, "action": "remind"},
+            {"kind": "routine", "id": 3, "action": "expire"}
+        ]
+        mock_patch.return_value.json.return_value = {
+            "results": [
+                {"updated": True},
+                {"updated": False},
+                {"updated": False}
+            ]
+        }
+
+        self.daemon.flush()
+
+        self.assertEqual(self.daemon.stale, {2})
+
+        self.daemon.stale = set()
+        self.daemon.actions = [
+            {"kind": "routine", "id": 1, "action": "remind"},
+            {"kind": "routine", "id": 3, "action": "expire"}
+        ]
+        mock_patch.return_value.raise_for_status.side_effect = Exception("down")
+
+        self.assertRaisesRegex(Exception, "down", self.daemon.flush)
+
+        self.assertEqual(self.daemon.stale, {1})
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_tasks(self):
+
+        mock_patch = self.daemon.session.patch
+
+        routine = {
+            "id": 1,
+            "data": {
+                "text": "hey",
+                "language": "cursing",
+                "tasks": [
+                    {
+                        "id": 0,
+                        "start": 0,
+                        "delay": 6,
+                        "start": 1,
+                        "paused": False,
+                        "interval": 2,
+                        "notified": 4
+                    }
+                ]
+            }
+        }
+
+        self.daemon.tasks(routine)
+        mock_patch.assert_has_calls([
+            unittest.mock.call("http://toast.com/routine/1/task/0/remind", json={"notified": 4}, timeout=10.0),
+            unittest.mock.call().raise_for_status()
+        ])
+        self.assertEqual(routine["data"]["tasks"][0]["notified"], 7)
+        self.assertEqual(routine["data"]["notified"], 7)
+
+        routine["data"]["tasks"][0]["notified"] = 7
+        self.daemon.tasks(routine)
+        mock_patch.assert_called_once()
+
+        routine["data"]["tasks"][0]["notified"] = 4
+        routine["data"]["tasks"][0]["end"] = 0
+        self.daemon.tasks(routine)
+        mock_patch.assert_called_once()
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_routine(self):
+
+        mock_patch = self.daemon.session.patch
+
+        evaluated = self.sample("chore_daemon_evaluated_total", kind="routine")
+        tasks = self.sample("chore_daemon_evaluated_total", kind="task")
+        expires = self.sample("chore_daemon_actions_total", kind="routine", action="expire")
+        reminds = self.sample("chore_daemon_actions_total", kind="task", action="remind")
+        late = self.sample("chore_daemon_lateness_seconds_sum", action="expire")
+
+        routine =  {
+            "id": 1,
+            "data": {
+                "start": 0,
+                "expires": 6
+            }
+        }
+
+        self.daemon.routine(routine)
+
+        mock_patch.assert_has_calls([
+            unittest.mock.call("http://toast.com/routine/1/expire", json={}, timeout=10.0),
+            unittest.mock.call().raise_for_status(),
+        ])
+
+        routine =  {
+            "id": 1,
+            "data": {
+                "start": 0,
+                "delay": 6,
+                "start": 1,
+                "paused": False,
+                "interval": 2,
+                "notified": 4,
+                "text": "hey",
+                "language": "cursing",
+                "tasks": [
+                    {
+                        "id": 0,
+                        "start": 0,
+                        "delay": 6,
+                        "start": 1,
+                        "paused": False,
+                        "interval": 2,
+                        "notified": 4
+                    }
+                ]
+            }
+        }
+
+        mock_patch.reset_mock()
+        mock_patch.return_value.json.return_value = {"updated": True}
+
+        self.daemon.routine(routine)
+
+        mock_patch.assert_has_calls([
+            unittest.mock.call("http://toast.com/routine/1/remind", json={"notified": 4}, timeout=10.0),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call().json(),
+            unittest.mock.call("http://toast.com/routine/1/task/0/remind", json={"notified": 4}, timeout=10.0),
+            unittest.mock.call().raise_for_status(),
+            unittest.mock.call().json()
+        ])
+        self.assertEqual(self.daemon.deadlines, [(9, 1)])
+        self.assertEqual(self.daemon.scheduled, {1: 9})
+
+        self.assertEqual(self.sample("chore_daemon_evaluated_total", kind="routine"), evaluated + 2)
+        self.assertEqual(self.sample("chore_daemon_evaluated_total", kind="task"), tasks + 1)
+        self.assertEqual(self.sample("chore_daemon_actions_total", kind="routine", action="expire"), expires + 1)
+        self.assertEqual(self.sample("chore_daemon_actions_total", kind="task", action="remind"), reminds + 1)
+        self.assertEqual(self.sample("chore_daemon_lateness_seconds_sum", action="expire"), late + 1)
+
+        routine["data"]["notified"] = 7
+        routine["data"]["tasks"][0]["notified"] = 7
+
+        self.daemon.routine(routine)
+        self.assertEqual(mock_patch.call_count, 2)
+
+    @unittest.skipIf(service.numpy is None, "needs numpy")
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_evaluate(self):
+
+        evaluated = self.sample("chore_daemon_evaluated_total", kind="routine")
+        tasks = self.sample("chore_daemon_evaluated_total", kind="task")
+
+        routines = [
+            {"id": 1, "data": {"start": 0, "expires": 6}},
+            {"id": 2, "data": {"start": 0, "expires": 8}},
+            {"id": 3, "data": {"start": 1, "delay": 6, "interval": 2, "notified": 4}},
+            {"id": 4, "data": {"start": 1, "delay": 6, "interval": 2, "notified": 5}},
+            {"id": 5, "data": {"start": 1, "interval": 2, "notified": 4, "paused": True}},
+            {"id": 6, "data": {"start": 1, "tasks": [
+                {"id": 0, "start": 1, "end": 2, "interval": 1, "notified": 1},
+                {"id": 1, "start": 2, "interval": 2, "notified": 4}
+            ]}},
+            {"id": 7, "data": {"start": 1, "delay": 9, "interval": 2, "notified": 4, "tasks": [
+                {"id": 0, "start": 1, "interval": 3, "notified": 5}
+            ]}},
+            {"id": 8, "data": {"start": 1, "tasks": [
+                {"id": 0, "start": 1, "expires": 1}
+            ]}},
+            {"id": 9, "data": {"start": 1}}
+        ]
+
+        self.assertEqual(self.daemon.evaluate(routines, 7), [routines[0], routines[2], routines[5]])
+
+        # Everything idle should be scheduled same as one at a time
+
+        self.assertEqual(self.daemon.scheduled, {2: 8, 7: 8})
+
+        (scheduled, deadlines) = (self.daemon.scheduled, sorted(self.daemon.deadlines))
+
+        self.daemon.scheduled = {}
+        self.daemon.deadlines = []
+
+        for routine in [routines[1], routines[3], routines[4], routines[6], routines[7], routines[8]]:
+            self.daemon.schedule(routine, 7)
+
+        self.assertEqual(self.daemon.scheduled, scheduled)
+        self.assertEqual(sorted(self.daemon.deadlines), deadlines)
+
+        self.assertEqual(self.sample("chore_daemon_evaluated_total", kind="routine"), evaluated + 6)
+        self.assertEqual(self.sample("chore_daemon_evaluated_total", kind="task"), tasks + 2)
+
+        self.assertEqual(self.daemon.evaluate([], 7), [])
+
+    @unittest.mock.patch("service.Daemon.routine")
+    @unittest.mock.patch("traceback.format_exc")
+    @unittest.mock.patch('builtins.print')
+    def test_dispatch(self, mock_print, mock_traceback, mock_routine):
+
+        self.daemon.dispatch("hey")
+        mock_routine.assert_called_once_with("hey", None)
+
+        self.daemon.dispatch("you", 7)
+        mock_routine.assert_called_with("you", 7)
+
+        failures = self.sample("chore_daemon_failures_total", stage="routine")
+
+        mock_routine.side_effect= [Exception("whoops")]
+        mock_traceback.return_value = "spirograph"
+
+        self.daemon.dispatch("hey")
+
+        self.assertEqual(self.sample("chore_daemon_failures_total", stage="routine"), failures + 1)
+
+        mock_print.assert_has_calls([
+            unittest.mock.call("whoops"),
+            unittest.mock.call("spirograph")
+        ])
+
+    def test_select(self):
+
+        self.daemon.mysql = unittest.mock.MagicMock()
+        mock_cursor = self.daemon.mysql.cursor.return_value.__enter__.return_value
+        mock_cursor.fetchall.return_value = [
+            (1, "opened", '{"text": "hey"}')
+        ]
+
+        self.assertEqual(self.daemon.select("updated >= %s", 5), [
+            {
+                "id": 1,
+                "status": "opened",
+                "data": {"text": "hey"}
+            }
+        ])
+
+        self.daemon.mysql.ping.assert_called_once_with(reconnect=True)
+        mock_cursor.execute.assert_called_once_with("SELECT id, status, data FROM routine WHERE updated >= %s", (5, ))
+
+    def test_get(self):
+
+        mock_get = self.daemon.session.get
+        mock_get.return_value.json.return_value = {"routines": []}
+
+        self.assertEqual(self.daemon.get("/routine?status=opened"), {"routines": []})
+        mock_get.assert_called_once_with(f"{self.daemon.chore}/routine?status=opened", timeout=self.daemon.timeout)
+
+        # An error response raises rather than being read as if it worked
+
+        mock_get.return_value.raise_for_status.side_effect = requests.exceptions.HTTPError("500 Server Error")
+
+        self.assertRaisesRegex(requests.exceptions.HTTPError, "500 Server Error", self.daemon.get, "/routine/1")
+
+    @unittest.mock.patch("service.time.time")
+    def test_sync(self, mock_time):
+
+        mock_get = self.daemon.session.get
+
+        mock_time.return_value = 7
+        mock_get.return_value.json.return_value = {
+            "routines": [
+                {
+                    "id": 1,
+                    "status": "opened"
+                },
+                {
+                    "id": 2,
+                    "status": "opened"
+                }
+            ]
+        }
+
+        self.daemon.sync()
+
+        mock_get.assert_called_with("http://toast.com/routine?status=opened&fields=id,status,data", timeout=10.0)
+        self.assertEqual(self.daemon.routines, {
+            1: {
+                "id": 1,
+                "status": "opened"
+            },
+            2: {
+                "id": 2,
+                "status": "opened"
+            }
+        })
+        self.assertEqual(self.daemon.synced, 7)
+        self.assertEqual(self.daemon.resynced, 7)
+
+        mock_time.return_value = 8645
+        mock_get.return_value.json.return_value = {
+            "routines": [
+                {
+                    "id": 1,
+                    "status": "closed"
+                },
+                {
+                    "id": 3,
+                    "status": "opened"
+                }
+            ]
+        }
+        self.daemon.resync = 10000
+        self.daemon.stale = {2, 3}
+
+        self.daemon.sync()
+
+        mock_get.assert_called_with("http://toast.com/routine?since=0.1&fields=id,status,data", timeout=10.0)
+        self.assertEqual(self.daemon.stale, {2})
+        self.assertEqual(self.daemon.routines, {
+            2: {
+                "id": 2,
+                "status": "opened"
+            },
+            3: {
+                "id": 3,
+                "status": "opened"
+            }
+        })
+        self.assertEqual(self.daemon.synced, 8645)
+        self.assertEqual(self.daemon.resynced, 7)
+
+        mock_time.return_value = 10008
+        mock_get.return_value.json.return_value = {
+            "routines": [
+                {
+                    "id": 4,
+                    "status": "opened"
+                }
+            ]
+        }
+
+        self.daemon.sync()
+
+        mock_get.assert_called_with("http://toast.com/routine?status=opened&fields=id,status,data", timeout=10.0)
+        self.assertEqual(self.daemon.stale, set())
+        self.assertEqual(self.daemon.routines, {
+            4: {
+                "id": 4,
+                "status": "opened"
+            }
+        })
+        self.assertEqual(self.daemon.resynced, 10008)
+
+        self.daemon.redis = True
+        mock_get.reset_mock()
+        mock_time.return_value = 10010
+
+        self.daemon.sync()
+
+        mock_get.assert_not_called()
+        self.assertEqual(self.daemon.synced, 10010)
+
+        self.daemon.redis = None
+        self.daemon.source = "due"
+        mock_time.return_value = 10011.5
+        mock_get.return_value.json.return_value = {
+            "routines": [
+                {
+                    "id": 5,
+                    "status": "opened"
+                }
+            ],
+            "next": 10020
+        }
+
+        self.daemon.sync()
+
+        mock_get.assert_called_with("http://toast.com/routine/due?at=10012.2&fields=id,status,data", timeout=10.0)
+        self.assertEqual(self.daemon.routines, {
+            5: {
+                "id": 5,
+                "status": "opened"
+            }
+        })
+        self.assertEqual(self.daemon.resynced, 10011.5)
+
+        # Straight from the database, all then what's changed
+
+        self.daemon.source = "mysql"
+        self.daemon.mysql = True
+        self.daemon.resynced = None
+        mock_get.reset_mock()
+        mock_time.return_value = 10012
+
+        with unittest.mock.patch("service.Daemon.select") as mock_select:
+
+            mock_select.return_value = [{"id": 6, "status": "opened"}]
+            self.daemon.sync()
+            mock_select.assert_called_once_with("status = 'opened'")
+            self.assertEqual(self.daemon.routines, {6: {"id": 6, "status": "opened"}})
+
+            mock_time.return_value = 10020
+            mock_select.return_value = [{"id": 6, "status": "closed"}, {"id": 7, "status": "opened"}]
+            self.daemon.sync()
+            mock_select.assert_called_with("updated >= %s", 10010)
+            self.assertEqual(self.daemon.routines, {7: {"id": 7, "status": "opened"}})
+
+        mock_get.assert_not_called()
+
+    def test_parse(self):
+
+        body = json.dumps({"routines": [
+            {"id": 1, "name": "caf\u00e9", "yaml": "big", "data": {"text": "[, ]"}},
+            {"id": 2, "status": "opened"}
+        ]}, ensure_ascii=False).encode()
+
+        # Split everywhere, even mid character
+
+        for size in [1, 7, len(body)]:
+            self.assertEqual(list(self.daemon.parse(body[index:index + size] for index in range(0, len(body), size))), [
+                {"id": 1, "name": "caf\u00e9", "data": {"text": "[, ]"}},
+                {"id": 2, "status": "opened"}
+            ])
+
+        self.assertEqual(list(self.daemon.parse([b'{"routines": []}'])), [])
+
+        routines = self.daemon.parse([b'{"routines": [{"id": 1}, {"id"'])
+
+        self.assertEqual(next(routines), {"id": 1})
+        self.assertRaisesRegex(ValueError, "routine list ended early", next, routines)
+
+    def test_stream(self):
+
+        mock_get = self.daemon.session.get
+        mock_get.return_value.elapsed.total_seconds.return_value = 0.5
+        mock_get.return_value.iter_content.return_value = [b'{"routines": [{"id": 1}, {"id": 2}, {"id": 3}]}']
+
+        with unittest.mock.patch("service.Daemon.dispatch") as mock_dispatch:
+            self.daemon.stream(7)
+
+        mock_get.assert_called_once_with("http://toast.com/routine?status=opened&fields=id,status,data", stream=True, timeout=10.0)
+        mock_get.return_value.raise_for_status.assert_called_once_with()
+        mock_get.return_value.iter_content.assert_called_once_with(16384)
+        mock_get.return_value.close.assert_called_once_with()
+        mock_dispatch.assert_has_calls([
+            unittest.mock.call({"id": 1}, 7),
+            unittest.mock.call({"id": 2}, 7),
+            unittest.mock.call({"id": 3}, 7)
+        ])
+        self.assertEqual(self.daemon.resynced, 7)
+        self.assertEqual(self.daemon.latency, 0.5)
+        self.assertEqual(self.daemon.routines, {})
+
+        # With workers, only a few are in flight at a time
+
+        self.daemon.workers = 1
+        self.daemon.pool = unittest.mock.MagicMock()
+        self.daemon.partitions = 2
+        self.daemon.owned = {1}
+        mock_get.return_value.iter_content.return_value = [b'{"routines": [{"id": 1}, {"id": 3}, {"id": 5}, {"id": 6}]}']
+
+        self.daemon.stream(8)
+
+        self.daemon.pool.submit.assert_has_calls([
+            unittest.mock.call(self.daemon.dispatch, {"id": 1}, 8),
+            unittest.mock.call(self.daemon.dispatch, {"id": 3}, 8),
+            unittest.mock.call(self.daemon.dispatch, {"id": 5}, 8)
+        ])
+        self.assertEqual(self.daemon.pool.submit.call_count, 3)
+        self.assertEqual(self.daemon.pool.submit.return_value.result.call_count, 3)
+
+        mock_get.return_value.iter_content.return_value = [b'{"routines": [{"id": 1}']
+        mock_get.return_value.close.reset_mock()
+
+        self.assertRaisesRegex(ValueError, "routine list ended early", self.daemon.stream, 9)
+        mock_get.return_value.close.assert_called_once_with()
+        self.assertEqual(self.daemon.resynced, 9)
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    @unittest.mock.patch("service.Daemon.flush")
+    @unittest.mock.patch("service.Daemon.sync")
+    @unittest.mock.patch("service.Daemon.dispatch")
+    @unittest.mock.patch("traceback.format_exc")
+    @unittest.mock.patch('builtins.print')
+    def test_process(self, mock_print, mock_traceback, mock_dispatch, mock_sync, mock_flush):
+
+        self.daemon.vectorize = False
+        self.daemon.routines = {
+            1: {"id": 1},
+            2: {"id": 2}
+        }
+
+        passes = self.sample("chore_daemon_pass_seconds_count")
+
+        self.daemon.push(1, 2)
+        self.daemon.process()
+
+        mock_sync.assert_called_once_with()
+        self.assertEqual(self.sample("chore_daemon_pass_seconds_count"), passes + 1)
+
+        mock_dispatch.assert_has_calls([
+            unittest.mock.call({"id": 1}, 7),
+            unittest.mock.call({"id": 2}, 7)
+        ])
+        self.assertEqual(self.daemon.deadlines, [])
+        self.assertEqual(self.daemon.scheduled, {})
+
+        mock_dispatch.reset_mock()
+        self.daemon.pool = unittest.mock.MagicMock()
+
+        self.daemon.process()
+
+        self.daemon.pool.map.assert_called_once_with(self.daemon.dispatch, [{"id": 1}, {"id": 2}], [7, 7])
+        mock_dispatch.assert_not_called()
+        self.assertEqual(mock_flush.call_count, 2)
+
+        self.daemon.pool = None
+        self.daemon.partitions = 2
+        self.daemon.owned = {0}
+
+        self.daemon.process()
+
+        mock_dispatch.assert_called_once_with({"id": 2}, 7)
+
+        mock_flush.side_effect = [Exception("whoops")]
+        mock_traceback.return_value = "spirograph"
+
+        self.daemon.process()
+
+        mock_print.assert_has_calls([
+            unittest.mock.call("whoops"),
+            unittest.mock.call("spirograph")
+        ])
+
+        # Vectorized, only what needs acting on gets dispatched
+
+        mock_dispatch.reset_mock()
+        mock_flush.side_effect = None
+        self.daemon.vectorize = True
+        self.daemon.owned = None
+
+        with unittest.mock.patch("service.Daemon.evaluate", return_value=[{"id": 2}]) as mock_evaluate:
+            self.daemon.process()
+
+        mock_evaluate.assert_called_once_with([{"id": 1}, {"id": 2}], 7)
+        mock_dispatch.assert_called_once_with({"id": 2}, 7)
+
+        # If syncing fails, it's counted, what's cached still goes out, and polling backs off
+
+        mock_dispatch.reset_mock()
+        mock_flush.reset_mock()
+        mock_sync.side_effect = [requests.exceptions.ConnectionError("refused")]
+        self.daemon.vectorize = False
+        self.daemon.interval = 8
+        self.daemon.bounds = (1, 30)
+        failures = self.sample("chore_daemon_failures_total", stage="sync")
+
+        self.daemon.process()
+
+        self.assertEqual(self.sample("chore_daemon_failures_total", stage="sync"), failures + 1)
+        mock_dispatch.assert_has_calls([
+            unittest.mock.call({"id": 1}, 7),
+            unittest.mock.call({"id": 2}, 7)
+        ])
+        mock_flush.assert_called_once_with()
+        self.assertEqual(self.daemon.interval, 16)
+        mock_print.assert_has_calls([
+            unittest.mock.call("refused")
+        ])
+        mock_sync.side_effect = None
+
+        # Anything stale isn't acted on from the cache, but checked afresh
+
+        mock_dispatch.reset_mock()
+        self.daemon.stale = {1}
+
+        self.daemon.process()
+
+        mock_dispatch.assert_called_once_with({"id": 2}, 7)
+        self.assertEqual(self.daemon.scheduled, {1: 7})
+
+        # Streaming doesn't sync, just goes through what comes in
+
+        mock_sync.reset_mock()
+        mock_flush.reset_mock()
+        self.daemon.source = "stream"
+        failures = self.sample("chore_daemon_failures_total", stage="stream")
+
+        with unittest.mock.patch("service.Daemon.stream") as mock_stream:
+
+            self.daemon.process()
+            mock_stream.assert_called_once_with(7)
+
+            mock_stream.side_effect = [Exception("oops")]
+            self.daemon.process()
+
+        mock_sync.assert_not_called()
+        self.assertEqual(mock_flush.call_count, 2)
+        self.assertEqual(self.sample("chore_daemon_failures_total", stage="stream"), failures + 1)
+        mock_print.assert_has_calls([
+            unittest.mock.call("oops")
+        ])
+
+    @unittest.mock.patch("service.Daemon.flush")
+    @unittest.mock.patch("service.Daemon.routine")
+    @unittest.mock.patch("traceback.format_exc")
+    @unittest.mock.patch('builtins.print')
+    def test_check(self, mock_print, mock_traceback, mock_routine, mock_flush):
+
+        mock_get = self.daemon.session.get
+
+        mock_get.return_value.json.return_value = {
+            "routine": {
+                "id": 1,
+                "status": "opened"
+            }
+        }
+
+        self.daemon.check(1)
+
+        mock_get.assert_called_with("http://toast.com/routine/1?fields=id,status,data", timeout=10.0)
+        mock_routine.assert_called_once_with({
+            "id": 1,
+            "status": "opened"
+        })
+        mock_flush.assert_called_once_with()
+        self.assertEqual(self.daemon.routines, {
+            1: {
+                "id": 1,
+                "status": "opened"
+            }
+        })
+
+        mock_get.return_value.json.return_value = {
+            "routine": {
+                "id": 1,
+                "status": "closed"
+            }
+        }
+
+        self.daemon.check(1)
+        mock_routine.assert_called_once()
+        self.assertEqual(self.daemon.routines, {})
+
+        mock_get.return_value.json.side_effect = [Exception("whoops")]
+        mock_traceback.return_value = "spirograph"
+
+        self.daemon.check(1)
+
+        mock_print.assert_has_calls([
+            unittest.mock.call("whoops"),
+            unittest.mock.call("spirograph")
+        ])
+
+        self.daemon.redis = True
+        mock_get.reset_mock()
+        mock_routine.reset_mock()
+
+        self.daemon.check(2)
+        mock_routine.assert_not_called()
+
+        self.daemon.routines = {
+            2: {
+                "id": 2,
+                "status": "opened"
+            }
+        }
+
+        self.daemon.check(2)
+        mock_routine.assert_called_once_with({
+            "id": 2,
+            "status": "opened"
+        })
+        mock_get.assert_not_called()
+
+        # Stale, it goes and gets the latest instead of trusting what's cached
+
+        mock_routine.reset_mock()
+        self.daemon.stale = {2}
+        mock_get.return_value.json.side_effect = None
+        mock_get.return_value.json.return_value = {
+            "routine": {
+                "id": 2,
+                "status": "opened",
+                "data": {"notified": 3}
+            }
+        }
+
+        self.daemon.check(2)
+        mock_get.assert_called_once_with("http://toast.com/routine/2?fields=id,status,data", timeout=10.0)
+        mock_routine.assert_called_once_with({
+            "id": 2,
+            "status": "opened",
+            "data": {"notified": 3}
+        })
+        self.assertEqual(self.daemon.routines[2]["data"], {"notified": 3})
+        self.assertEqual(self.daemon.stale, set())
+
+        mock_get.reset_mock()
+        mock_routine.reset_mock()
+        self.daemon.partitions = 2
+        self.daemon.owned = {1}
+
+        self.daemon.check(2)
+        mock_routine.assert_not_called()
+
+        self.daemon.owned = None
+        self.daemon.source = "stream"
+        self.daemon.routines = {}
+
+        mock_get.return_value.json.side_effect = None
+        mock_get.return_value.json.return_value = {
+            "routine": {
+                "id": 2,
+                "status": "opened"
+            }
+        }
+
+        self.daemon.check(2)
+        mock_get.assert_called_once_with("http://toast.com/routine/2?fields=id,status,data", timeout=10.0)
+        mock_routine.assert_called_once_with({
+            "id": 2,
+            "status": "opened"
+        })
+        self.assertEqual(self.daemon.routines, {})
+
+        self.daemon.source = "mysql"
+        self.daemon.redis = None
+        self.daemon.mysql = True
+        mock_get.reset_mock()
+        mock_routine.reset_mock()
+
+        with unittest.mock.patch("service.Daemon.select") as mock_select:
+
+            mock_select.return_value = [{"id": 3, "status": "opened"}]
+            self.daemon.check(3)
+            mock_select.assert_called_once_with("id = %s", 3)
+            mock_routine.assert_called_once_with({"id": 3, "status": "opened"})
+
+            mock_select.return_value = []
+            self.daemon.check(4)
+            mock_routine.assert_called_once()
+
+        mock_get.assert_not_called()
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    def test_receive(self):
+
+        self.daemon.receive({
+            "kind": "todos",
+            "action": "remind"
+        })
+
+        self.assertEqual(self.daemon.routines, {})
+        self.assertFalse(self.daemon.wake.is_set())
+
+        self.daemon.stale = {1}
+
+        self.daemon.receive({
+            "kind": "routine",
+            "action": "create",
+            "routine": {
+                "id": 1,
+                "status": "opened"
+            }
+        })
+
+        self.assertEqual(self.daemon.stale, set())
+
+        self.assertEqual(self.daemon.routines, {
+            1: {
+                "id": 1,
+                "status": "opened"
+            }
+        })
+        self.assertEqual(self.daemon.scheduled, {1: 7})
+        self.assertTrue(self.daemon.wake.is_set())
+
+        self.daemon.wake.clear()
+
+        self.daemon.receive({
+            "kind": "task",
+            "action": "complete",
+            "task": {},
+            "routine": {
+                "id": 1,
+                "status": "closed"
+            }
+        })
+
+        self.assertEqual(self.daemon.routines, {})
+        self.assertTrue(self.daemon.wake.is_set())
+
+        self.daemon.partitions = 2
+        self.daemon.owned = {1}
+
+        self.daemon.receive({
+            "kind": "routine",
+            "action": "create",
+            "routine": {
+                "id": 2,
+                "status": "opened"
+            }
+        })
+
+        self.assertIn(2, self.daemon.routines)
+        self.assertNotIn(2, self.daemon.scheduled)
+
+        self.daemon.source = "stream"
+        self.daemon.owned = None
+
+        self.daemon.receive({
+            "kind": "routine",
+            "action": "create",
+            "routine": {
+                "id": 3,
+                "status": "opened"
+            }
+        })
+
+        self.assertNotIn(3, self.daemon.routines)
+        self.assertEqual(self.daemon.scheduled[3], 7)
+
+    @unittest.mock.patch("service.time.sleep")
+    @unittest.mock.patch("traceback.format_exc")
+    @unittest.mock.patch('builtins.print')
+    def test_subscribe(self, mock_print, mock_traceback, mock_sleep):
+
+        self.daemon.redis = MockRedis("most.com", 667)
+        self.daemon.channel = "stuff"
+
+        self.daemon.redis.pubsubs = [
+            MockPubSub([
+                {
+                    "type": "subscribe",
+                    "data": 1
+                },
+                {
+                    "type": "message",
+                    "data": json.dumps({
+                        "kind": "routine",
+                        "action": "create",
+                        "routine": {
+                            "id": 1,
+                            "status": "opened"
+                        }
+                    })
+                },
+                Exception("whoops")
+            ])
+        ]
+
+        self.daemon.resynced = 7
+        mock_traceback.return_value = "spirograph"
+        mock_sleep.side_effect = [Exception("adaisy")]
+
+        self.assertRaisesRegex(Exception, "adaisy", self.daemon.subscribe)
+
+        self.assertIsNone(self.daemon.resynced)
+        self.assertEqual(self.daemon.routines, {
+            1: {
+                "id": 1,
+                "status": "opened"
+            }
+        })
+
+        mock_print.assert_has_calls([
+            unittest.mock.call("whoops"),
+            unittest.mock.call("spirograph")
+        ])
+
+        mock_sleep.assert_called_once_with(0.7)
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    @unittest.mock.patch("service.time.sleep")
+    def test_wait(self, mock_sleep):
+
+        self.daemon.wait(6)
+        mock_sleep.assert_not_called()
+
+        self.daemon.wait(8.5)
+        mock_sleep.assert_called_once_with(1.5)
+
+        self.daemon.redis = True
+        self.daemon.wake = unittest.mock.MagicMock()
+
+        self.daemon.wait(8.5)
+        self.daemon.wake.wait.assert_called_once_with(1.5)
+        self.daemon.wake.clear.assert_called_once_with()
+        mock_sleep.assert_called_once()
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    @unittest.mock.patch("service.Daemon.check")
+    @unittest.mock.patch("service.time.sleep")
+    def test_run(self, mock_sleep, mock_check):
+
+        mock_get = self.daemon.session.get
+
+        mock_get.return_value.json.return_value = {
+            "routines": [
+                {
+                    "id": 1,
+                    "status": "opened",
+                    "data": {
+                        "start": 7,
+                        "expires": 0.5
+                    }
+                },
+                {
+                    "id": 2,
+                    "status": "opened",
+                    "data": {
+                        "start": 7,
+                        "expires": 0.25
+                    }
+                },
+                {
+                    "id": 3,
+                    "status": "opened",
+                    "data": {
+                        "start": 7,
+                        "expires": 1
+                    }
+                }
+            ]
+        }
+
+        # Sleeping is the only way time moves along here, so jump to the end of the wait
+
+        def sleep(delay):
+
+            if mock_sleep.call_count > 3:
+                raise Exception("adaisy")
+
+            service.time.time.return_value += delay
+
+        mock_sleep.side_effect = sleep
+
+        self.assertRaisesRegex(Exception, "adaisy", self.daemon.run)
+
+        mock_check.assert_has_calls([
+            unittest.mock.call(2),
+            unittest.mock.call(1)
+        ])
+        self.assertEqual(mock_check.call_count, 2)
+
+        self.assertEqual(mock_sleep.call_args_list[0], unittest.mock.call(0.25))
+        self.assertEqual(mock_sleep.call_args_list[1], unittest.mock.call(0.25))
+        self.assertAlmostEqual(mock_sleep.call_args_list[2][0][0], 0.2)
+
+    @unittest.mock.patch("service.time.time", unittest.mock.MagicMock(return_value=7))
+    @unittest.mock.patch("service.Daemon.check")
+    @unittest.mock.patch("service.time.sleep")
+    @unittest.mock.patch("traceback.format_exc")
+    @unittest.mock.patch('builtins.print')
+    def test_run_down(self, mock_print, mock_traceback, mock_sleep, mock_check):
+
+        self.daemon.session.get.side_effect = requests.exceptions.ConnectionError("refused")
+        self.daemon.interval = 2
+        self.daemon.bounds = (1, 30)
+
+        def sleep(delay):
+
+            if mock_sleep.call_count > 3:
+                raise Exception("adaisy")
+
+            service.time.time.return_value += delay
+
+        mock_sleep.side_effect = sleep
+
+        # With the API down, it keeps going, waiting longer each time
+
+        self.assertRaisesRegex(Exception, "adaisy", self.daemon.run)
+
+        mock_check.assert_not_called()
+        self.assertEqual(mock_sleep.call_args_list, [
+            unittest.mock.call(4),
+            unittest.mock.call(8),
+            unittest.mock.call(16),
+            unittest.mock.call(30)
+        ])
+
+    @unittest.mock.patch.dict(os.environ, {
+        "CHORE_API": "http://toast.com",
+        "SLEEP": "0.7",
+        "REDIS_HOST": "most.com",
+        "REDIS_PORT": "667",
+        "REDIS_CHANNEL": "stuff"
+    })
+    @unittest.mock.patch("redis.StrictRedis", MockRedis)
+    @unittest.mock.patch("requests.Session", unittest.mock.MagicMock)
+    @unittest.mock.patch("prometheus_client.start_http_server")
+    @unittest.mock.patch("threading.Thread")
+    @unittest.mock.patch("service.Daemon.process")
+    def test_run_redis(self, mock_process, mock_thread, mock_server):
+
+        daemon = service.Daemon()
+
+        mock_process.side_effect = [None, Exception("adaisy")]
+
+        self.assertRaisesRegex(Exception, "adaisy", daemon.run)
+        mock_server.assert_not_called()
+
+        mock_thread.assert_called_once_with(target=daemon.subscribe, daemon=True)
+        mock_thread.return_value.start.assert_called_once_with()
+
+        daemon.owned = set()
+        mock_thread.reset_mock()
+        mock_process.side_effect = [Exception("adaisy")]
+
+        self.assertRaisesRegex(Exception, "adaisy", daemon.run)
+
+        mock_thread.assert_has_calls([
+            unittest.mock.call(target=daemon.subscribe, daemon=True),
+            unittest.mock.call().start(),
+            unittest.mock.call(target=daemon.heartbeat, daemon=True),
+            unittest.mock.call().start()
+        ])
+
+        daemon.metrics = 9090
+        mock_process.side_effect = [Exception("adaisy")]
 
-        mock_sleep.assert_called_with(0.7)
+        self.assertRaisesRegex(Exception, "adaisy", daemon.run)
+        mock_server.assert_called_once_with(9090)